@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Analyzes every path through the story.
+
+Counts the ways the story can be played through to each ending and to each
+branch that hasn't been written yet ("This path has not been written yet"),
+finds the longest playthrough, and lists nodes that can never be reached and
+redirects that go round in loops.
+
+The number of playthroughs grows exponentially with the depth of the story,
+so they are counted, not listed: the nodes are visited once, in an order
+where every node comes after all the nodes that lead to it, and each node
+passes the number of ways to reach it on to the nodes it leads to. Choices
+that lead back to a node earlier in the same playthrough are reported as
+loops and not followed, since a loop could be played round any number of
+times.
+
+Big stories are split into the parts below the first few choices, which are
+counted in parallel on a process pool and added up. Stories with loops are
+counted in one process, since which choices loop back depends on the path
+taken from the start.
+
+Usage:
+    python analyze_story.py [story.json] [--jobs N] [--top N] [--json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from story import (NO_NODE, NO_STRING, STORY_FILE, StoryError, get_worker_story, open_compiled_story,
+                   start_story_worker)
+
+# Stories with at least this many nodes are counted on a process pool
+PARALLEL_NODES = 100000
+
+# How many parts to split a story into for each worker process
+PARTS_PER_JOB = 4
+
+# How many choices deep to look for parts to split the story into
+MAX_SPLIT_DEPTH = 12
+
+
+# --- Counting ---
+def walk_story(story, root):
+    """
+    Visits every node reachable from `root` depth first, trying each node's
+    choices in order, without recursion.
+
+    Returns:
+        tuple: (order, back_edges, loops). `order` lists the nodes reached,
+            each after every node it leads to (post-order). `back_edges` is
+            the set of choices (as indexes into story.targets) that lead back
+            to a node earlier on the same path, and `loops` lists the nodes
+            each of them goes round.
+    """
+    starts = story.choice_starts
+    targets = story.targets
+    state = bytearray(story.node_count)   # 0: not reached, 1: on the path, 2: done
+    order = []
+    back_edges = set()
+    loops = []
+    state[root] = 1
+    work = [(root, starts[root])]
+    while work:
+        node, edge = work[-1]
+        end = starts[node + 1]
+        while edge < end:
+            target = targets[edge]
+            edge += 1
+            if target == NO_NODE:
+                continue
+            if state[target] == 0:
+                # Visit the target first, then carry on with the next choice
+                work[-1] = (node, edge)
+                state[target] = 1
+                work.append((target, starts[target]))
+                break
+            if state[target] == 1:
+                back_edges.add(edge - 1)
+                path = [step[0] for step in work]
+                loops.append(path[path.index(target):])
+        else:
+            work.pop()
+            state[node] = 2
+            order.append(node)
+    return order, back_edges, loops
+
+
+def count_paths(story, root):
+    """
+    Counts the playthroughs that start at `root`. Choices that lead back to
+    a node earlier on the same path are loops, and aren't followed.
+
+    Returns:
+        dict: "endings" maps each ending node reached to (paths, longest
+            path), "unwritten" maps each (node, choice) that leads nowhere to
+            (paths, longest path), "loops" lists the nodes of each loop, and
+            "reached" is an array of every node reached. Path lengths are
+            counted in choices.
+    """
+    starts = story.choice_starts
+    targets = story.targets
+    order, back_edges, loops = walk_story(story, root)
+
+    ways = {root: 1}
+    depth = {root: 0}
+    endings = {}
+    unwritten = {}
+    for node in reversed(order):
+        node_ways = ways[node]
+        node_depth = depth[node]
+        first, end = starts[node], starts[node + 1]
+        if first == end:
+            endings[node] = (node_ways, node_depth)
+        for edge in range(first, end):
+            target = targets[edge]
+            if target == NO_NODE:
+                unwritten[(node, edge - first)] = (node_ways, node_depth + 1)
+            elif edge not in back_edges:
+                ways[target] = ways.get(target, 0) + node_ways
+                if depth.get(target, -1) < node_depth + 1:
+                    depth[target] = node_depth + 1
+    return {"endings": endings, "unwritten": unwritten, "loops": loops, "reached": array('I', order)}
+
+
+def _count_part(root):
+    """Counts the playthroughs of one part of the story, in a worker process."""
+    return root, count_paths(get_worker_story(), root)
+
+
+def split_story(story, parts):
+    """
+    Follows the choices from the start, level by level, until there are at
+    least `parts` nodes to carry on from.
+
+    Returns:
+        tuple: (frontier, expanded, endings, unwritten). `frontier` maps each
+            (node, depth) to carry on from to the number of ways to get
+            there; `expanded` is the set of nodes passed through on the way.
+            Endings and unwritten branches met on the way are in the same
+            form as count_paths returns them.
+    """
+    starts = story.choice_starts
+    targets = story.targets
+    frontier = {(story.start, 0): 1}
+    expanded = set()
+    endings = {}
+    unwritten = {}
+    for _level in range(MAX_SPLIT_DEPTH):
+        if len({node for node, _depth in frontier}) >= parts:
+            break
+        next_frontier = {}
+        for (node, depth), node_ways in frontier.items():
+            expanded.add(node)
+            first, end = starts[node], starts[node + 1]
+            if first == end:
+                add_result(endings, node, node_ways, depth)
+                continue
+            for edge in range(first, end):
+                target = targets[edge]
+                if target == NO_NODE:
+                    add_result(unwritten, (node, edge - first), node_ways, depth + 1)
+                else:
+                    key = (target, depth + 1)
+                    next_frontier[key] = next_frontier.get(key, 0) + node_ways
+        frontier = next_frontier
+        if not frontier:
+            break
+    return frontier, expanded, endings, unwritten
+
+
+def add_result(results, key, ways, depth):
+    """Adds `ways` paths of length up to `depth` to results[key]."""
+    old_ways, old_depth = results.get(key, (0, 0))
+    results[key] = (old_ways + ways, max(old_depth, depth))
+
+
+def analyze(story, jobs=1, source_path=STORY_FILE):
+    """
+    Counts every playthrough of a story, on `jobs` processes if the story is
+    big enough to be worth it. Returns the combined results of count_paths.
+    """
+    if jobs <= 1 or story.node_count < PARALLEL_NODES:
+        return count_paths(story, story.start)
+
+    frontier, expanded, endings, unwritten = split_story(story, jobs * PARTS_PER_JOB)
+    roots = sorted({node for node, _depth in frontier})
+    reached = bytearray(story.node_count)
+    for node in expanded:
+        reached[node] = 1
+    with ProcessPoolExecutor(jobs, initializer=start_story_worker, initargs=(source_path,)) as pool:
+        results = dict(pool.map(_count_part, roots, chunksize=max(1, len(roots) // (jobs * 4))))
+
+    for (root, offset), root_ways in frontier.items():
+        result = results[root]
+        for node, (ways, depth) in result["endings"].items():
+            add_result(endings, node, ways * root_ways, depth + offset)
+        for branch, (ways, depth) in result["unwritten"].items():
+            add_result(unwritten, branch, ways * root_ways, depth + offset)
+    for result in results.values():
+        if result["loops"]:
+            # Which choices count as looping back depends on the path taken
+            # from the start, so a story with loops is counted in one go
+            return count_paths(story, story.start)
+        for node in result["reached"]:
+            reached[node] = 1
+    return {"endings": endings, "unwritten": unwritten, "loops": [],
+            "reached": array('I', (node for node in range(story.node_count) if reached[node]))}
+
+
+# --- Report ---
+def build_report(story, result, top=10):
+    """Turns the results of analyze into a dictionary for printing or saving."""
+    reached = bytearray(story.node_count)
+    for node in result["reached"]:
+        reached[node] = 1
+    redirects = [node for node in range(story.node_count)
+                 if not reached[node] and story.redirects[node] != NO_STRING]
+    unreachable = [node for node in range(story.node_count)
+                   if not reached[node] and story.redirects[node] == NO_STRING]
+    endings = result["endings"]
+    unwritten = result["unwritten"]
+    ending_paths = sum(ways for ways, _depth in endings.values())
+    unwritten_paths = sum(ways for ways, _depth in unwritten.values())
+    depths = [depth for _ways, depth in endings.values()] + [depth for _ways, depth in unwritten.values()]
+
+    top_endings = sorted(endings.items(), key=lambda item: (-item[1][0], item[0]))[:top]
+    top_unwritten = sorted(unwritten.items(), key=lambda item: (-item[1][0], item[0]))[:top]
+    return {
+        "nodes": story.node_count,
+        "reachable_nodes": len(result["reached"]),
+        "redirect_nodes": len(redirects),
+        "unreachable_nodes": [story.key(node) for node in unreachable],
+        "endings": len(endings),
+        "unwritten_branches": len(unwritten),
+        "playthroughs": ending_paths + unwritten_paths,
+        "playthroughs_to_endings": ending_paths,
+        "playthroughs_to_unwritten": unwritten_paths,
+        "longest_playthrough": max(depths, default=0),
+        "loops": [[story.key(node) for node in loop + loop[:1]] for loop in result["loops"]],
+        "top_endings": [{"node": story.key(node), "playthroughs": ways, "longest": depth}
+                        for node, (ways, depth) in top_endings],
+        "top_unwritten": [{"node": story.key(node), "choice": choice + 1, "playthroughs": ways,
+                           "longest": depth}
+                          for (node, choice), (ways, depth) in top_unwritten],
+    }
+
+
+def print_report(report, seconds):
+    """Prints a report made by build_report."""
+    print(f"Nodes:                {report['nodes']} ({report['reachable_nodes']} reachable, "
+          f"{report['redirect_nodes']} redirects, {len(report['unreachable_nodes'])} unreachable)")
+    print(f"Endings:              {report['endings']} "
+          f"({report['playthroughs_to_endings']} playthroughs end at one)")
+    print(f"Unwritten branches:   {report['unwritten_branches']} "
+          f"({report['playthroughs_to_unwritten']} playthroughs reach one)")
+    print(f"Playthroughs:         {report['playthroughs']}")
+    print(f"Longest playthrough:  {report['longest_playthrough']} choices")
+    print(f"Loops:                {len(report['loops'])}")
+    for loop in report["loops"]:
+        print(f"    {' -> '.join(loop)}")
+    if report["unreachable_nodes"]:
+        print(f"Unreachable nodes:    {', '.join(report['unreachable_nodes'][:20])}")
+    if report["top_endings"]:
+        print("Most reached endings:")
+        for ending in report["top_endings"]:
+            print(f"    {ending['node']:<24} {ending['playthroughs']:>10} playthroughs, "
+                  f"longest {ending['longest']} choices")
+    if report["top_unwritten"]:
+        print("Most reached unwritten branches:")
+        for branch in report["top_unwritten"]:
+            print(f"    {branch['node'] + ' choice ' + str(branch['choice']):<24} "
+                  f"{branch['playthroughs']:>10} playthroughs")
+    print(f"Analyzed in {seconds * 1000:.1f} ms")
+
+
+def main():
+    """Parses the command line, analyzes the story and prints the report."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("story", nargs="?", default=STORY_FILE, help="the story.json file to analyze")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for big stories (default: one per core)")
+    parser.add_argument("--top", type=int, default=10, help="how many endings and branches to list")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        story = open_compiled_story(args.story)
+    except StoryError as e:
+        print(f"Error: {e}")
+        return 1
+
+    start = time.perf_counter()
+    result = analyze(story, args.jobs, args.story)
+    report = build_report(story, result, args.top)
+    seconds = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report, seconds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Writing files so that a reader never sees one half-written.
+
+The game keeps several files it writes itself and reads back later: the
+compiled story, the typing sound clip, the font cache and traces. If the
+game stopped, or another copy of it read the file, while it was being
+written, the reader would get a truncated file. atomic_path hands out a
+temporary file next to the real one to write instead, and moves it into
+place with os.replace only once it is complete, which replaces the old
+file in one step.
+"""
+
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path to write the contents of `path` to. When the
+    block finishes, the temporary file replaces `path`; if it raises, the
+    temporary file is removed and `path` is left as it was.
+
+    Args:
+        path (str): The file to write.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+Sound loading for the game.
+
+The typing sound effect is a 20 second recording, but only a short burst of
+it is heard before it is started again, so decoding the whole file into a
+Sound wastes memory and startup time. Instead the first few seconds are read
+with the wave module, converted to the mixer's sample rate and channel count,
+faded in and out so the clip loops without clicking, and written to a small
+cache file. Later runs load the cached clip straight into a Sound.
+
+Loading happens on a background thread so the first frame doesn't have to
+wait for it. AudioStarter goes further and also opens the audio device on
+that thread, since that can take a while too.
+
+The game can also do without the recording: KeyClicks synthesizes a small
+bank of short key clicks at startup and plays one for each character as it
+is typed. NumPy is used to generate them when it is installed; otherwise
+they are built sample by sample with the array module.
+
+TypingAudio decides when either of them is played. Every mixer call takes
+SDL's audio lock, so it only calls the mixer when its state changes.
+"""
+
+import math
+import os
+import random
+import sys
+import threading
+import time
+import wave
+from array import array
+
+import pygame
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from atomic_file import atomic_path
+
+# Where the game's sound files are kept
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+TYPING_SOUND_FILE = os.path.join(ASSETS_DIR, "mixkit-fast-laptop-keyboard-typing-1392.wav")
+
+# Converted clips are cached here. Delete the folder to rebuild them.
+AUDIO_CACHE_DIR = os.path.join(ASSETS_DIR, "cache")
+
+# The part of the typing recording that is used, in seconds
+TYPING_CLIP_START = 0.0
+TYPING_CLIP_LENGTH = 2.0
+
+# Length of the fade at each end of a clip, in seconds
+CLIP_FADE = 0.005
+
+# Synthesized key clicks: how many variants, how long each one is in seconds,
+# and how many channels they are played on so quick clicks can overlap
+CLICK_VARIANTS = 6
+CLICK_LENGTH = 0.02
+CLICK_CHANNELS = 4
+
+# The mixer channel the typing recording is played on, and the event posted
+# when it stops playing
+TYPING_CHANNEL = 1
+TYPING_SOUND_END = pygame.event.custom_type()
+
+
+# --- Clip Conversion ---
+def read_clip(path, start, length):
+    """
+    Reads `length` seconds of a 16-bit WAV file, starting `start` seconds in,
+    without reading the rest of the file.
+
+    Returns:
+        tuple: (samples, frame rate, channels), the samples being an array of
+            interleaved signed 16-bit values.
+    """
+    with wave.open(path, "rb") as source:
+        if source.getsampwidth() != 2:
+            raise ValueError(f"'{path}' is not a 16-bit WAV file")
+        rate = source.getframerate()
+        channels = source.getnchannels()
+        first = min(int(start * rate), source.getnframes())
+        source.setpos(first)
+        frames = source.readframes(int(length * rate))
+    samples = array('h', frames)
+    if sys.byteorder == "big":
+        samples.byteswap()  # WAV files are little-endian
+    return samples, rate, channels
+
+
+def convert_clip(samples, rate, channels, out_rate, out_channels):
+    """
+    Converts interleaved 16-bit samples to another frame rate and channel
+    count. Frames are resampled by linear interpolation; stereo is mixed
+    down to mono by averaging, and mono is copied to every output channel.
+    """
+    frame_count = len(samples) // channels
+    if channels != out_channels:
+        if out_channels == 1:
+            mixed = array('h', (sum(samples[i:i + channels]) // channels
+                                for i in range(0, frame_count * channels, channels)))
+        else:
+            mixed = array('h')
+            for i in range(0, frame_count * channels, channels):
+                mixed.extend([samples[i]] * out_channels)
+        samples, channels = mixed, out_channels
+
+    if rate == out_rate or frame_count < 2:
+        return samples
+    out_count = frame_count * out_rate // rate
+    step = (frame_count - 1) / max(1, out_count - 1)
+    resampled = array('h', bytes(out_count * channels * 2))
+    for frame in range(out_count):
+        position = frame * step
+        index = int(position)
+        fraction = position - index
+        next_index = min(index + 1, frame_count - 1)
+        for channel in range(channels):
+            a = samples[index * channels + channel]
+            b = samples[next_index * channels + channel]
+            resampled[frame * channels + channel] = int(a + (b - a) * fraction)
+    return resampled
+
+
+def fade_clip(samples, rate, channels, fade=CLIP_FADE):
+    """Fades both ends of a clip in place so it starts and stops silently."""
+    frame_count = len(samples) // channels
+    fade_frames = min(int(fade * rate), frame_count // 2)
+    for frame in range(fade_frames):
+        gain = frame / fade_frames
+        for channel in range(channels):
+            head = frame * channels + channel
+            tail = (frame_count - 1 - frame) * channels + channel
+            samples[head] = int(samples[head] * gain)
+            samples[tail] = int(samples[tail] * gain)
+
+
+def clip_cache_path(source, start, length, rate, channels):
+    """
+    Returns where the converted clip of `source` is cached. The name records
+    everything the clip depends on, so a changed source file, clip or mixer
+    setting gets a clip of its own instead of a stale one.
+    """
+    stat = os.stat(source)
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(AUDIO_CACHE_DIR, f"{name}-{stat.st_size}-{int(stat.st_mtime)}-"
+                                         f"{int(start * 1000)}-{int(length * 1000)}ms-"
+                                         f"{rate}hz-{channels}ch.wav")
+
+
+def build_clip(source, start, length, rate, channels, cache_path=None):
+    """
+    Cuts and converts a clip and, if `cache_path` is given, writes it there
+    as a 16-bit WAV file. Failing to write the cache is not an error.
+
+    Returns:
+        bytes: The clip's frames as signed 16-bit samples in native byte order.
+    """
+    samples, source_rate, source_channels = read_clip(source, start, length)
+    samples = convert_clip(samples, source_rate, source_channels, rate, channels)
+    fade_clip(samples, rate, channels)
+    frames = samples.tobytes()
+
+    if cache_path is not None:
+        if sys.byteorder == "big":
+            samples.byteswap()
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with atomic_path(cache_path) as temp_path, wave.open(temp_path, "wb") as cache:
+                cache.setnchannels(channels)
+                cache.setsampwidth(2)
+                cache.setframerate(rate)
+                cache.writeframes(samples.tobytes())
+        except OSError as e:
+            print(f"Warning: Could not cache the typing sound clip. Error: {e}")
+    return frames
+
+
+def load_clip(source, start, length):
+    """
+    Returns a Sound holding `length` seconds of `source` starting at `start`,
+    in the format the mixer plays. The clip is read from the cache when it's
+    there and built (and cached) otherwise.
+
+    Returns:
+        tuple: (sound, built) where `built` is True if the cache was missed.
+    """
+    rate, sample_format, channels = pygame.mixer.get_init()
+    cache_path = clip_cache_path(source, start, length, rate, channels)
+    built = False
+    frames = None
+    if os.path.exists(cache_path):
+        try:
+            with wave.open(cache_path, "rb") as cache:
+                frames = cache.readframes(cache.getnframes())
+            if sys.byteorder == "big":
+                samples = array('h', frames)
+                samples.byteswap()
+                frames = samples.tobytes()
+        except (OSError, EOFError, wave.Error):
+            frames = None
+    if frames is None:
+        frames = build_clip(source, start, length, rate, channels, cache_path)
+        built = True
+
+    if sample_format == -16:
+        # Already in the mixer's format, so the bytes can be used as they are
+        return pygame.mixer.Sound(buffer=frames), built
+    if os.path.exists(cache_path):
+        # Let the mixer convert the cached file to its sample format
+        return pygame.mixer.Sound(cache_path), built
+    return pygame.mixer.Sound(source), built
+
+
+def full_sound_bytes(source):
+    """Returns how much memory `source` would use if decoded into a Sound whole."""
+    rate, sample_format, channels = pygame.mixer.get_init()
+    with wave.open(source, "rb") as wav:
+        frames = wav.getnframes() * rate // wav.getframerate()
+    return frames * channels * (abs(sample_format) // 8)
+
+
+# --- SoundLoader Class (Loads a sound on a background thread) ---
+class SoundLoader:
+    """
+    Loads the typing sound clip on a background thread. The main loop checks
+    is_done() each frame and picks up the sound once it's ready; until then
+    the game simply runs without it.
+    """
+    def __init__(self, source=TYPING_SOUND_FILE, start=TYPING_CLIP_START, length=TYPING_CLIP_LENGTH):
+        """
+        Initializes the SoundLoader object and starts loading.
+
+        Args:
+            source (str): Path to the WAV file to take the clip from.
+            start (float): Where the clip starts in the file, in seconds.
+            length (float): Length of the clip, in seconds.
+        """
+        self.source = source
+        self.start = start
+        self.length = length
+        self.sound = None
+        self.error = None
+        self.report = None
+        self.started_at = time.perf_counter()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="SoundLoader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        """Loads the clip and records how it went. Runs on the loader thread."""
+        try:
+            if not os.path.exists(self.source):
+                self.error = f"Sound file not found at '{self.source}'."
+                return
+            sound, built = load_clip(self.source, self.start, self.length)
+            clip_bytes = len(sound.get_raw())
+            full_bytes = full_sound_bytes(self.source)
+            seconds = time.perf_counter() - self.started_at
+            self.report = (f"Typing sound: {clip_bytes / 1024:.0f} KB clip instead of "
+                           f"{full_bytes / 1024:.0f} KB ({(full_bytes - clip_bytes) / 1024:.0f} KB saved), "
+                           f"{'built' if built else 'loaded from cache'} in {seconds * 1000:.1f} ms")
+            self.sound = sound
+        except (pygame.error, OSError, EOFError, ValueError, wave.Error) as e:
+            self.error = f"Could not load typing sound. Game will run without it. Error: {e}"
+        finally:
+            self._done.set()
+
+    def is_done(self):
+        """Returns True once loading has finished, whether or not it worked."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for loading to finish and returns the sound, or None."""
+        self._done.wait(timeout)
+        return self.sound
+
+
+# --- AudioStarter Class (Starts the mixer and the typing sound in the background) ---
+class AudioStarter:
+    """
+    Initializes the mixer and prepares the typing sound on a background
+    thread. The main loop checks is_done() and hands the clicks or the sound
+    to the typewriter once they're ready; until then the game runs silently.
+    """
+    def __init__(self, typing_sound="clicks"):
+        """
+        Initializes the AudioStarter object and starts the mixer.
+
+        Args:
+            typing_sound (str): "clicks" for synthesized key clicks, falling
+                back to the recording if they can't be made, or "recording".
+        """
+        self.typing_sound = typing_sound
+        self.clicks = None
+        self.sound = None
+        self.error = None
+        self.report = None
+        self.mixer_seconds = None   # How long opening the audio device took
+        self.sound_seconds = None   # How long preparing the typing sound took
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._start, name="AudioStarter", daemon=True)
+        self._thread.start()
+
+    def _start(self):
+        """Starts the mixer and prepares the sound. Runs on the starter thread."""
+        try:
+            started_at = time.perf_counter()
+            try:
+                pygame.mixer.init()
+            except pygame.error as e:
+                self.error = f"No audio device available. Game will run without sound. Error: {e}"
+                return
+            self.mixer_seconds = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            if self.typing_sound == "clicks":
+                clicks = KeyClicks()
+                if clicks.is_available():
+                    self.clicks = clicks
+                    self.report = (f"Typing sound: {len(clicks.sounds)} key clicks "
+                                   f"({clicks.get_bytes() / 1024:.0f} KB)")
+            if self.clicks is None:
+                loader = SoundLoader()
+                self.sound = loader.wait()
+                self.error = loader.error
+                self.report = loader.report
+            self.sound_seconds = time.perf_counter() - started_at
+        finally:
+            self._done.set()
+
+    def is_done(self):
+        """Returns True once the mixer and sound are ready, or have failed."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Waits for the mixer and sound. Returns False if it timed out."""
+        return self._done.wait(timeout)
+
+
+# --- Key Click Synthesis ---
+def click_parameters(count, seed=0):
+    """
+    Returns the random settings of each click variant: the loudness, how fast
+    the noise burst dies away, and the pitch and decay of the low thump.
+    """
+    rng = random.Random(seed)
+    return [(rng.uniform(0.25, 0.4), rng.uniform(250, 450),
+             rng.uniform(120, 260), rng.uniform(60, 140)) for _ in range(count)]
+
+
+def synthesize_click_numpy(rate, length, volume, noise_decay, pitch, thump_decay, seed):
+    """Returns one click as an array of floats between -1 and 1, built with NumPy."""
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(int(rate * length)) / rate
+    noise = rng.uniform(-1.0, 1.0, len(t)) * numpy.exp(-t * noise_decay)
+    thump = numpy.sin(2 * math.pi * pitch * t) * numpy.exp(-t * thump_decay)
+    click = (0.6 * noise + 0.4 * thump) * volume
+    click[-int(rate * CLIP_FADE):] *= numpy.linspace(1.0, 0.0, int(rate * CLIP_FADE))
+    return click
+
+
+def synthesize_click_array(rate, length, volume, noise_decay, pitch, thump_decay, seed):
+    """Returns one click as a list of floats between -1 and 1, without NumPy."""
+    rng = random.Random(seed)
+    count = int(rate * length)
+    fade_frames = int(rate * CLIP_FADE)
+    click = []
+    for i in range(count):
+        t = i / rate
+        noise = rng.uniform(-1.0, 1.0) * math.exp(-t * noise_decay)
+        thump = math.sin(2 * math.pi * pitch * t) * math.exp(-t * thump_decay)
+        sample = (0.6 * noise + 0.4 * thump) * volume
+        if i >= count - fade_frames:
+            sample *= (count - 1 - i) / max(1, fade_frames - 1)
+        click.append(sample)
+    return click
+
+
+def make_click_sound(click):
+    """
+    Turns a click (floats between -1 and 1) into a Sound in the mixer's
+    format, or returns None if that format can't be built here.
+    """
+    _rate, sample_format, channels = pygame.mixer.get_init()
+    if numpy is not None:
+        dtypes = {-8: numpy.int8, 8: numpy.uint8, -16: numpy.int16, 16: numpy.uint16}
+        if abs(sample_format) == 32:
+            samples = numpy.asarray(click, dtype=numpy.float32)
+        elif sample_format in dtypes:
+            bits = abs(sample_format)
+            scale = 2 ** (bits - 1) - 1
+            offset = 0 if sample_format < 0 else scale + 1
+            samples = (numpy.asarray(click) * scale + offset).astype(dtypes[sample_format])
+        else:
+            return None
+        if channels > 1:
+            samples = numpy.repeat(samples[:, None], channels, axis=1)
+        return pygame.sndarray.make_sound(numpy.ascontiguousarray(samples))
+
+    if sample_format != -16:
+        return None
+    samples = array('h')
+    for sample in click:
+        samples.extend([int(sample * 32767)] * channels)
+    return pygame.mixer.Sound(buffer=samples.tobytes())
+
+
+# --- KeyClicks Class (Plays a synthesized click per character) ---
+class KeyClicks:
+    """
+    A bank of synthesized key clicks, played one per typed character on a
+    small pool of mixer channels.
+
+    Each variant is a short burst of decaying noise over a low thump, with
+    slightly different settings, so repeated keys don't all sound the same.
+    The whole bank takes a few tens of KB instead of the megabytes of the
+    recorded typing sound.
+    """
+    def __init__(self, variants=CLICK_VARIANTS, length=CLICK_LENGTH, channels=CLICK_CHANNELS,
+                 first_channel=TYPING_CHANNEL + 1, seed=0):
+        """
+        Initializes the KeyClicks object and synthesizes its clicks.
+
+        Args:
+            variants (int): How many different clicks to generate.
+            length (float): Length of each click, in seconds.
+            channels (int): How many mixer channels to play the clicks on.
+            first_channel (int): The first of the mixer channels to use.
+            seed (int): Seed for the random settings, so the bank is the
+                same every time the game runs.
+        """
+        rate = pygame.mixer.get_init()[0]
+        synthesize = synthesize_click_numpy if numpy is not None else synthesize_click_array
+        self.sounds = []
+        for i, settings in enumerate(click_parameters(variants, seed)):
+            sound = make_click_sound(synthesize(rate, length, *settings, seed=seed + i))
+            if sound is None:
+                break
+            self.sounds.append(sound)
+
+        if pygame.mixer.get_num_channels() < first_channel + channels:
+            pygame.mixer.set_num_channels(first_channel + channels)
+        self.channels = [pygame.mixer.Channel(first_channel + i) for i in range(channels)]
+        self._next_channel = 0
+        self._rng = random.Random(seed)
+        self._last_variant = -1
+
+    def is_available(self):
+        """Returns False if no clicks could be made for the mixer's format."""
+        return bool(self.sounds)
+
+    def get_bytes(self):
+        """Returns the memory taken by the clicks' samples."""
+        return sum(len(sound.get_raw()) for sound in self.sounds)
+
+    def play(self, char=" "):
+        """
+        Plays a click for a typed character, on the next channel of the pool.
+        Newlines make no sound. A different variant from the last one is
+        picked each time.
+        """
+        if not self.sounds or char == "\n":
+            return
+        variant = self._rng.randrange(len(self.sounds))
+        if variant == self._last_variant:
+            variant = (variant + 1) % len(self.sounds)
+        self._last_variant = variant
+        self.channels[self._next_channel].play(self.sounds[variant])
+        self._next_channel = (self._next_channel + 1) % len(self.channels)
+
+
+# --- TypingAudio Class (Plays the typing sound as text is revealed) ---
+class TypingAudio:
+    """
+    A small state machine that plays the typing sound while text is typed.
+
+    States:
+        "idle"      Nothing is being typed and nothing is playing.
+        "typing"    Text is being typed. The recording plays, or a key click
+                    is played for each update that reveals characters.
+        "stopping"  Typing finished and the recording was stopped; waiting
+                    for the channel's end event.
+
+    Instead of asking the channel whether it's busy, the recording's channel
+    posts TYPING_SOUND_END whenever a sound on it ends or is stopped, and the
+    main loop passes that event to handle_event. Only state changes call the
+    mixer, and the calls made while each story node is shown are counted.
+    """
+    def __init__(self, sound=None, clicks=None, channel=TYPING_CHANNEL):
+        """
+        Initializes the TypingAudio object.
+
+        Args:
+            sound (pygame.mixer.Sound, optional): Recording to loop while typing.
+            clicks (KeyClicks, optional): Key clicks to play instead of `sound`.
+            channel (int): The mixer channel to play `sound` on.
+        """
+        self.sound = None
+        self.clicks = clicks
+        self.channel_id = channel
+        self.channel = None
+        self.state = "idle"
+        self.pending_ends = 0     # Plays whose end event hasn't arrived yet
+        self.node = None
+        self.mixer_calls = {}     # Node -> mixer calls made while it was shown
+        self.set_sound(sound)
+
+    def _count_call(self):
+        """Counts one mixer call against the current node."""
+        self.mixer_calls[self.node] = self.mixer_calls.get(self.node, 0) + 1
+
+    def _play(self):
+        """Starts the recording on its channel."""
+        self.channel.play(self.sound)
+        self.pending_ends += 1
+        self._count_call()
+
+    def set_sound(self, sound):
+        """Sets the recording played while typing. None turns it off."""
+        if self.channel is not None and self.state == "typing" and self.pending_ends:
+            self.channel.stop()
+            self._count_call()
+        self.sound = sound
+        if sound is not None and self.channel is None and pygame.mixer.get_init():
+            self.channel = pygame.mixer.Channel(self.channel_id)
+            self.channel.set_endevent(TYPING_SOUND_END)
+        if self.state == "typing" and self.is_enabled() and not self.pending_ends:
+            self._play()
+
+    def set_clicks(self, clicks):
+        """Sets the key clicks played while typing, instead of the recording. None turns them off."""
+        self.clicks = clicks
+
+    def set_node(self, node):
+        """Sets the story node that following mixer calls are counted against."""
+        self.node = node
+
+    def is_enabled(self):
+        """Returns True if there is anything to play."""
+        return self.clicks is not None or (self.sound is not None and self.channel is not None)
+
+    def typed(self, char):
+        """
+        Called when characters have been revealed. `char` is the last of them.
+        """
+        if self.clicks is not None:
+            self.clicks.play(char)
+            self._count_call()
+        elif self.state != "typing" and self.is_enabled() and not self.pending_ends:
+            # A recording still playing after a stop will end soon and be restarted
+            self._play()
+        self.state = "typing"
+
+    def finished(self):
+        """Called when all the text has been revealed, or skipped."""
+        if self.state != "typing":
+            return
+        if self.clicks is None and self.pending_ends:
+            self.channel.stop()
+            self._count_call()
+            self.state = "stopping"
+        else:
+            self.state = "idle"
+
+    def handle_event(self, event):
+        """Handles TYPING_SOUND_END events; other events are ignored."""
+        if event.type != TYPING_SOUND_END or not self.pending_ends:
+            return
+        self.pending_ends -= 1
+        if self.pending_ends:
+            return  # An older play was cut short by a newer one
+        if self.state == "typing" and self.sound is not None:
+            self._play()  # Loop the recording while typing goes on
+        elif self.state == "stopping":
+            self.state = "idle"
+
+    def get_mixer_calls(self):
+        """Returns a copy of the mixer call counts, by node."""
+        return dict(self.mixer_calls)
@@ -0,0 +1,700 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the game's text layout.
+
+Runs without opening a window by using SDL's dummy video driver.
+
+Usage:
+    python benchmark.py wrap        Compare layout_text with TypewriterText.wrap_text
+    python benchmark.py story       Time compiling and loading stories of growing size
+    python benchmark.py nodes       Compare NodeStore with a dict of dicts like choices_tree
+    python benchmark.py engine      Time StoryEngine making choices
+    python benchmark.py frames      Time TypewriterText.update and draw per frame
+    python benchmark.py prefetch    Check and time showing prefetched story text
+    python benchmark.py dirty       Check that dirty-rect frames match full redraws
+    python benchmark.py idle        Measure CPU time and wakeups while waiting for a key
+
+The frames suite can also save its results as JSON with --json, to compare
+frame times between versions of the game. The idle suite measures with
+whichever video driver SDL_VIDEODRIVER selects, e.g. SDL_VIDEODRIVER=x11 to
+measure on a real display instead of the dummy driver.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from main import HEIGHT, PRIMARY_FONT, WIDTH, TypewriterText
+from prefetch import Prefetcher
+from story import NO_NODE, NodeStore, StoryEngine, compile_story_file, load_story
+from text_layout import layout_text
+from text_render import LineSurfaceCache
+
+# Words used to generate passages of any length
+SAMPLE_WORDS = ("You are playing a newly released game in a dark, silent room. It's your "
+                "deserved reward after all. You waited 14 years for it. The noise on the "
+                "other side stops abruptly; the silence is now even more terrifying.").split()
+
+# Markup tags wrapped around words of generated passages, in turn
+SAMPLE_TAGS = ("red", "b", "gold", "i", "green", "u")
+
+# Length of one frame at the game's 60 frames per second, in milliseconds
+FRAME_MS = 1000 / 60
+
+
+class CountingFont(pygame.font.Font):
+    """A font that counts how often text is measured."""
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.size_calls = 0
+
+    def size(self, text):
+        self.size_calls += 1
+        return super().size(text)
+
+
+def make_passage(length, seed=0):
+    """Returns pseudo-random story text of about `length` characters."""
+    rng = random.Random(seed)
+    words = []
+    total = 0
+    while total < length:
+        word = rng.choice(SAMPLE_WORDS)
+        if rng.random() < 0.02:
+            word += "\n"
+        words.append(word)
+        total += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def mark_up(text, density, seed=0):
+    """Wraps about `density` (0 to 1) of the words in `text` in markup tags."""
+    rng = random.Random(seed)
+    words = text.split(" ")
+    for i, word in enumerate(words):
+        if word and rng.random() < density:
+            tag = SAMPLE_TAGS[i % len(SAMPLE_TAGS)]
+            words[i] = f"[{tag}]{word}[/{tag}]"
+    return " ".join(words)
+
+
+def load_font(spec):
+    """
+    Loads a font given as "name:size". The name "default" is pygame's own
+    font; the name can also be the path of a font file.
+    """
+    name, _, size = spec.rpartition(":")
+    path = None
+    if os.path.isfile(name):
+        path = name
+    elif name != "default":
+        path = pygame.font.match_font(name.replace(" ", "").lower())
+        if path is None:
+            print(f"Warning: font '{name}' not found, using pygame's default font")
+    return pygame.font.Font(path, int(size))
+
+
+def make_story(node_count, choices=2, seed=0):
+    """
+    Returns a story.json dictionary with `node_count` nodes, branching
+    `choices` ways at every node, breadth first from "start".
+    """
+    rng = random.Random(seed)
+    labels = [f"Choice {i + 1}" for i in range(choices)]
+    nodes = {}
+    queue = deque(["start"])
+    while queue and len(nodes) < node_count:
+        key = queue.popleft()
+        nodes[key] = {"text": make_passage(rng.randint(100, 400), rng.random()), "choices": labels}
+        prefix = "" if key == "start" else f"{key}_"
+        queue.extend(f"{prefix}{i + 1}" for i in range(choices))
+    return {"start": "start", "nodes": nodes}
+
+
+def make_tree(node_count, choices=2):
+    """
+    Returns a dict of dicts shaped like the old inline choices_tree, with
+    `node_count` nodes branching `choices` ways, breadth first from "start".
+    Every node shares the same text and labels so only the structure is
+    measured.
+    """
+    text = "The noise on the other side stops abruptly."
+    labels = [f"Choice {i + 1}" for i in range(choices)]
+    tree = {}
+    queue = deque(["start"])
+    while queue and len(tree) < node_count:
+        key = queue.popleft()
+        tree[key] = {"text": text, "choices": labels}
+        prefix = "" if key == "start" else f"{key}_"
+        queue.extend(f"{prefix}{i + 1}" for i in range(choices))
+    return tree
+
+
+def walk_tree(tree, picks):
+    """Makes the choices in `picks` the way the game used to, with string keys."""
+    key = "start"
+    for pick in picks:
+        if pick >= len(tree[key]["choices"]):
+            continue
+        if key == "start":
+            next_key = str(pick + 1)
+        else:
+            next_key = f"{key}_{pick + 1}"
+        target = tree.get(next_key)
+        if target is None:
+            key = "start"  # An unwritten path; start over
+        else:
+            key = target.get("redirect", next_key)
+    return key
+
+
+def walk_store(store, picks):
+    """Makes the choices in `picks` through a NodeStore's target table."""
+    node = store.start
+    choice_starts = store.choice_starts
+    targets = store.targets
+    for pick in picks:
+        first = choice_starts[node]
+        if pick >= choice_starts[node + 1] - first:
+            continue
+        node = targets[first + pick]
+        if node == NO_NODE:
+            node = store.start  # An unwritten path; start over
+    return node
+
+
+def percentiles(values):
+    """Returns the 50th, 95th and 99th percentiles of a list of values."""
+    if len(values) < 2:
+        return values * 3 if values else [0.0] * 3
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return [cuts[49], cuts[94], cuts[98]]
+
+
+def get_versions():
+    """Returns the versions of everything that affects the frame times."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "sdl": ".".join(str(part) for part in pygame.get_sdl_version()),
+        "platform": platform.platform(),
+        "video_driver": pygame.display.get_driver(),
+    }
+
+
+def best_time(func, repeat=5):
+    """Returns the fastest of `repeat` runs of func(), in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_wrap(args):
+    """Times wrapping passages of growing length with both line breakers."""
+    font_path = pygame.font.match_font(PRIMARY_FONT.replace(" ", "").lower())
+    font = CountingFont(font_path, 24)
+    max_width = 760
+    typewriter = TypewriterText("", font, (0, 0), max_width, 280)
+
+    print(f"{'chars':>8} {'wrap_text ms':>13} {'calls':>7} {'layout_text ms':>15} {'calls':>7} {'speedup':>8}")
+    for length in args.lengths:
+        text = make_passage(length)
+        layout_text(text, font, max_width)  # Fill the shared advance and kerning caches
+
+        font.size_calls = 0
+        typewriter.wrap_text(text)
+        wrap_calls = font.size_calls
+        font.size_calls = 0
+        layout_text(text, font, max_width)
+        layout_calls = font.size_calls
+
+        wrap_time = best_time(lambda: typewriter.wrap_text(text), args.repeat)
+        layout_time = best_time(lambda: layout_text(text, font, max_width), args.repeat)
+        print(f"{length:>8} {wrap_time * 1000:>13.2f} {wrap_calls:>7} "
+              f"{layout_time * 1000:>15.2f} {layout_calls:>7} {wrap_time / layout_time:>7.1f}x")
+
+
+def bench_story(args):
+    """Times compiling stories of growing size and loading the compiled files."""
+    print(f"{'nodes':>8} {'json.load ms':>13} {'compile ms':>11} {'read ms':>8} {'mmap ms':>8} {'size KB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for node_count in args.nodes:
+            source_path = os.path.join(directory, f"story{node_count}.json")
+            compiled_path = os.path.join(directory, f"story{node_count}.bin")
+            with open(source_path, "w", encoding="utf-8") as source_file:
+                json.dump(make_story(node_count), source_file)
+
+            def read_json():
+                with open(source_path, encoding="utf-8") as source_file:
+                    json.load(source_file)
+
+            json_time = best_time(read_json, args.repeat)
+            compile_time = best_time(lambda: compile_story_file(source_path, compiled_path), 1)
+            read_time = best_time(lambda: load_story(source_path, compiled_path, use_mmap=False), args.repeat)
+            mmap_time = best_time(lambda: load_story(source_path, compiled_path), args.repeat)
+            print(f"{node_count:>8} {json_time * 1000:>13.2f} {compile_time * 1000:>11.2f} "
+                  f"{read_time * 1000:>8.2f} {mmap_time * 1000:>8.2f} "
+                  f"{os.path.getsize(compiled_path) / 1024:>8.0f}")
+
+
+def bench_nodes(args):
+    """Compares the memory and transition cost of NodeStore and a dict of dicts."""
+    print(f"{'nodes':>9} {'dict MB':>8} {'store MB':>9} {'dict ns/step':>13} {'store ns/step':>14} {'speedup':>8}")
+    rng = random.Random(0)
+    picks = [rng.randrange(2) for _ in range(args.steps)]
+    for node_count in args.nodes:
+        tracemalloc.start()
+        tree = make_tree(node_count)
+        tree_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        store = NodeStore.from_source({"start": "start", "nodes": tree})
+        store.string_ids = {}   # Only needed while building
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tree_time = best_time(lambda: walk_tree(tree, picks), args.repeat) / len(picks)
+        store_time = best_time(lambda: walk_store(store, picks), args.repeat) / len(picks)
+        print(f"{node_count:>9} {tree_bytes / 2**20:>8.1f} {store_bytes / 2**20:>9.1f} "
+              f"{tree_time * 1e9:>13.0f} {store_time * 1e9:>14.0f} {tree_time / store_time:>7.1f}x")
+        del tree, store
+
+
+def bench_engine(args):
+    """
+    Times how many choose() calls per second StoryEngine handles, restarting
+    at endings. Picks are from 0 to 2, so some are turned down by nodes with
+    only two choices; those calls are counted too.
+    """
+    stories = [("story.bin", load_story())]
+    stories.extend((f"{count} nodes", NodeStore.from_source(make_story(count)))
+                   for count in args.nodes)
+    rng = random.Random(0)
+    picks = [rng.randrange(3) for _ in range(args.steps)]
+
+    print(f"{'story':>14} {'choose/s':>12} {'endings':>8}")
+    for name, story in stories:
+        engine = StoryEngine(story, skip_narrative=True)
+
+        def play():
+            endings = 0
+            for pick in picks:
+                engine.choose(pick)
+                if engine.state == "ending":
+                    endings += 1
+                    engine.restart()
+            return endings
+
+        endings = play()
+        seconds = best_time(play, args.repeat)
+        print(f"{name:>14} {len(picks) / seconds:>12,.0f} {endings:>8}")
+
+
+def start_case(typewriter, text, scroll):
+    """
+    Sets the typewriter's text and moves the cursor to where a case starts:
+    "top" at the beginning of the text, "middle" halfway through it, with
+    the area scrolled, or "end" with all of it typed.
+    """
+    typewriter.set_text(text)
+    if scroll == "middle":
+        typewriter.current_index = len(typewriter.full_text) // 2
+    elif scroll == "end":
+        typewriter.complete()
+
+
+def play_frames(typewriter, surface, frames, on_frame):
+    """
+    Updates and draws the typewriter `frames` times, as if FRAME_MS passed
+    between frames, calling on_frame(step) with "start", "update" and "draw"
+    around the steps so the caller can measure them.
+    """
+    owed = 0.0   # Typing time not yet used up by the typewriter
+    for _ in range(frames):
+        now = pygame.time.get_ticks()
+        typewriter.last_update = now - owed - FRAME_MS
+        on_frame("start")
+        typewriter.update()
+        on_frame("update")
+        surface.fill((0, 0, 0))
+        on_frame("fill")
+        typewriter.draw(surface)
+        on_frame("draw")
+        owed = now - typewriter.last_update
+
+
+def time_frames(typewriter, surface, frames):
+    """Returns the update and draw times of each frame, in milliseconds."""
+    update_times = []
+    draw_times = []
+    marks = {}
+
+    def on_frame(step):
+        marks[step] = time.perf_counter()
+        if step == "update":
+            update_times.append((marks["update"] - marks["start"]) * 1000)
+        elif step == "draw":
+            draw_times.append((marks["draw"] - marks["fill"]) * 1000)
+
+    play_frames(typewriter, surface, frames, on_frame)
+    return update_times, draw_times
+
+
+def trace_frames(typewriter, surface, frames):
+    """
+    Returns the memory each frame allocated, as (peak bytes, blocks). The
+    peak is the most memory the frame's update and draw held at once on top
+    of what was allocated before; blocks is the change in the number of
+    allocated memory blocks, i.e. what the frame left behind.
+    """
+    allocations = []
+    marks = {}
+
+    def on_frame(step):
+        if step == "start":
+            tracemalloc.reset_peak()
+            marks["bytes"] = tracemalloc.get_traced_memory()[0]
+            marks["blocks"] = sys.getallocatedblocks()
+        elif step == "draw":
+            peak = tracemalloc.get_traced_memory()[1] - marks["bytes"]
+            allocations.append((peak, sys.getallocatedblocks() - marks["blocks"]))
+
+    tracemalloc.start()
+    try:
+        play_frames(typewriter, surface, frames, on_frame)
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+
+def bench_frames(args):
+    """
+    Times TypewriterText.update and draw per frame for every combination of
+    text length, font, markup density and scroll position, and reports the
+    50th, 95th and 99th percentile frame times and the memory allocated per
+    frame. Allocations are measured in a second run of the same frames, under
+    tracemalloc, so tracing doesn't slow down the timed run.
+    """
+    surface = pygame.display.set_mode((WIDTH, HEIGHT))
+    fonts = [(spec, load_font(spec)) for spec in args.fonts]
+    results = []
+
+    print(f"{'chars':>8} {'font':>16} {'markup':>6} {'scroll':>6} {'set ms':>8} "
+          f"{'frame p50':>9} {'p95':>7} {'p99':>7} {'update p99':>10} {'draw p99':>8} {'alloc KB':>8} {'blocks':>6}")
+    for length in args.lengths:
+        passage = make_passage(length)
+        for markup in args.markup:
+            text = mark_up(passage, markup)
+            for spec, font in fonts:
+                typewriter = TypewriterText("", font, (20, 40), 760, 280, reveal_mode=args.mode)
+                typewriter.set_chars_per_second(args.chars_per_second)
+                for scroll in args.scroll:
+                    start = time.perf_counter()
+                    start_case(typewriter, text, scroll)
+                    set_text_ms = (time.perf_counter() - start) * 1000
+                    update_times, draw_times = time_frames(typewriter, surface, args.frames)
+
+                    start_case(typewriter, text, scroll)
+                    allocations = trace_frames(typewriter, surface, args.frames)
+
+                    frame_times = [update + draw for update, draw in zip(update_times, draw_times)]
+                    frame_p = percentiles(frame_times)
+                    update_p = percentiles(update_times)
+                    draw_p = percentiles(draw_times)
+                    alloc_p = percentiles([peak for peak, _blocks in allocations])
+                    blocks = sum(blocks for _peak, blocks in allocations) / len(allocations)
+                    results.append({
+                        "chars": length, "font": spec, "markup": markup, "scroll": scroll,
+                        "set_text_ms": set_text_ms,
+                        "frame_ms": dict(zip(("p50", "p95", "p99"), frame_p), max=max(frame_times)),
+                        "update_ms": dict(zip(("p50", "p95", "p99"), update_p)),
+                        "draw_ms": dict(zip(("p50", "p95", "p99"), draw_p)),
+                        "alloc_bytes": dict(zip(("p50", "p95", "p99"), alloc_p)),
+                        "blocks_per_frame": blocks,
+                    })
+                    print(f"{length:>8} {spec:>16} {markup:>6} {scroll:>6} {set_text_ms:>8.2f} "
+                          f"{frame_p[0]:>9.3f} {frame_p[1]:>7.3f} {frame_p[2]:>7.3f} {update_p[2]:>10.3f} "
+                          f"{draw_p[2]:>8.3f} {alloc_p[0] / 1024:>8.1f} {blocks:>6.1f}")
+
+    if args.json:
+        report = {
+            "suite": "frames",
+            "versions": get_versions(),
+            "settings": {"frames": args.frames, "chars_per_second": args.chars_per_second,
+                         "mode": args.mode, "frame_ms": FRAME_MS},
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=4)
+        print(f"Saved the results to '{args.json}'")
+
+
+def draw_both(typewriters, surfaces):
+    """
+    Draws each typewriter onto its own surface at the same moment of the
+    cursor's blink, and returns the drawn pixels and cursor rect of each.
+    """
+    while True:
+        blink = pygame.time.get_ticks() // 500
+        drawn = []
+        for typewriter, surface in zip(typewriters, surfaces):
+            surface.fill((0, 0, 0))
+            typewriter.draw(surface)
+            drawn.append((pygame.image.tobytes(surface, "RGB"), typewriter.get_cursor_rect()[0]))
+        if pygame.time.get_ticks() // 500 == blink:
+            return drawn
+
+
+def bench_prefetch(args):
+    """
+    Shows every node of the story both ways a choice can: with set_text
+    alone, and with the text prepared by a Prefetcher. Checks that the two
+    draw the same pixels and cursor at every index of the text, and times
+    the first frame (set_text and draw) of each. Returns 1 if any differ.
+    """
+    surfaces = [pygame.display.set_mode((WIDTH, HEIGHT)), pygame.Surface((WIDTH, HEIGHT))]
+    font = load_font(f"{PRIMARY_FONT}:24")
+    story = load_story()
+    mismatches = 0
+
+    print(f"{'node':>12} {'width':>5} {'chars':>6} {'fresh ms':>9} {'prefetched ms':>14} {'differing frames':>17}")
+    for width in args.widths:
+        fresh_times = []
+        prefetched_times = []
+        for node in range(story.node_count):
+            text = story.text(node)
+            if text is None:
+                continue
+            # Each typewriter gets an empty line cache, as after leaving a node
+            fresh = TypewriterText("", font, (20, 40), width, 280, line_cache=LineSurfaceCache())
+            prefetched = TypewriterText("", font, (20, 40), width, 280, line_cache=LineSurfaceCache())
+            prefetcher = Prefetcher(prefetched)
+            prefetcher.start([text])
+            while prefetcher.is_busy():
+                prefetcher.work()
+
+            start = time.perf_counter()
+            fresh.set_text(text)
+            fresh.draw(surfaces[0])
+            fresh_times.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            prefetched.set_text(text, prefetcher.take(text))
+            prefetched.draw(surfaces[1])
+            prefetched_times.append((time.perf_counter() - start) * 1000)
+
+            differing = 0
+            for index in range(len(fresh.full_text) + 1):
+                fresh.current_index = prefetched.current_index = index
+                (fresh_pixels, fresh_cursor), (pixels, cursor) = draw_both((fresh, prefetched), surfaces)
+                if pixels != fresh_pixels or cursor != fresh_cursor:
+                    differing += 1
+            mismatches += differing
+            print(f"{story.key(node):>12} {width:>5} {len(fresh.full_text):>6} {fresh_times[-1]:>9.3f} "
+                  f"{prefetched_times[-1]:>14.3f} {differing:>17}")
+        print(f"{'median':>12} {width:>5} {'':>6} {statistics.median(fresh_times):>9.3f} "
+              f"{statistics.median(prefetched_times):>14.3f}")
+
+    if mismatches:
+        print(f"Prefetched text was drawn differently in {mismatches} frames")
+        return 1
+    print("Prefetched text was drawn the same as fresh text in every frame")
+    return 0
+
+
+def bench_dirty(args):
+    """
+    Types a passage with every font and reveal mode, redrawing one surface
+    only in the areas get_dirty_rects returns and another in full each
+    frame, as the game loop does with USE_DIRTY_RECTS on and off. Counts
+    the frames where the two differ. Returns 1 if any do.
+    """
+    surfaces = [pygame.display.set_mode((WIDTH, HEIGHT)), pygame.Surface((WIDTH, HEIGHT))]
+    text = make_passage(args.length)
+    mismatches = 0
+
+    print(f"{'font':>40} {'mode':>6} {'frames':>6} {'differing':>9}")
+    for spec in args.fonts:
+        font = load_font(spec)
+        for mode in ("clip", "reflow"):
+            typewriter = TypewriterText(text, font, (20, 40), 760, 280, reveal_mode=mode)
+            typewriter.get_dirty_rects()
+            surfaces[0].fill((0, 0, 0))
+            typewriter.draw(surfaces[0])
+            differing = 0
+            for _ in range(args.frames):
+                typewriter.current_index = min(len(typewriter.full_text),
+                                               typewriter.current_index + args.chars_per_frame)
+                while True:
+                    # Draw both at the same moment of the cursor's blink
+                    blink = pygame.time.get_ticks() // 500
+                    for rect in typewriter.get_dirty_rects():
+                        surfaces[0].set_clip(rect)
+                        surfaces[0].fill((0, 0, 0))
+                        typewriter.draw(surfaces[0])
+                    surfaces[0].set_clip(None)
+                    surfaces[1].fill((0, 0, 0))
+                    typewriter.draw(surfaces[1])
+                    if pygame.time.get_ticks() // 500 == blink:
+                        break
+                if pygame.image.tobytes(surfaces[0], "RGB") != pygame.image.tobytes(surfaces[1], "RGB"):
+                    differing += 1
+            mismatches += differing
+            print(f"{spec:>40} {mode:>6} {args.frames:>6} {differing:>9}")
+
+    if mismatches:
+        print(f"Dirty-rect frames differed from full redraws {mismatches} times")
+        return 1
+    print("Dirty-rect frames matched full redraws in every frame")
+    return 0
+
+
+def get_process_usage():
+    """
+    Returns the CPU time the process has used, in seconds, and how many
+    times it has gone to sleep and woken up again (voluntary context
+    switches), or None for the latter where that isn't counted.
+    """
+    if resource is None:
+        return time.process_time(), None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_nvcsw
+
+
+def idle_poll(seconds):
+    """Waits `seconds` for a key the old way: polling events at 60 frames per second."""
+    clock = pygame.time.Clock()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pygame.event.get()
+        clock.tick(60)
+
+
+def idle_wait(seconds):
+    """Waits `seconds` for a key the way the game does: sleeping in pygame.event.wait."""
+    deadline = time.perf_counter() + seconds
+    while (remaining := deadline - time.perf_counter()) > 0:
+        pygame.event.wait(max(1, int(remaining * 1000)))
+
+
+def bench_idle(args):
+    """
+    Measures the CPU time and wakeups of the process while the game waits
+    for a key on the choice screen, polling at 60 frames per second as it
+    used to and sleeping in pygame.event.wait as it does now.
+    """
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    print(f"Video driver: {pygame.display.get_driver()}, {args.seconds:g} s idle per run")
+    print(f"{'strategy':>10} {'CPU ms/s':>9} {'wakeups/s':>10}")
+    for name, wait in (("poll", idle_poll), ("wait", idle_wait)):
+        pygame.event.clear()
+        cpu_start, switches_start = get_process_usage()
+        wait(args.seconds)
+        cpu_end, switches_end = get_process_usage()
+        cpu = (cpu_end - cpu_start) * 1000 / args.seconds
+        wakeups = "-" if switches_start is None else f"{(switches_end - switches_start) / args.seconds:.0f}"
+        print(f"{name:>10} {cpu:>9.2f} {wakeups:>10}")
+
+
+def main():
+    """Parses the command line and runs the selected benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+
+    wrap_parser = subparsers.add_parser("wrap", help="compare layout_text with wrap_text")
+    wrap_parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 4000, 16000, 64000],
+                             help="passage lengths in characters")
+    wrap_parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    wrap_parser.set_defaults(func=bench_wrap)
+
+    story_parser = subparsers.add_parser("story", help="time compiling and loading stories")
+    story_parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10000, 100000],
+                              help="story sizes in nodes")
+    story_parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    story_parser.set_defaults(func=bench_story)
+
+    nodes_parser = subparsers.add_parser("nodes", help="compare NodeStore with a dict of dicts")
+    nodes_parser.add_argument("--nodes", type=int, nargs="+", default=[100000, 1000000],
+                              help="story sizes in nodes")
+    nodes_parser.add_argument("--steps", type=int, default=1000000, help="choices made per walk")
+    nodes_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    nodes_parser.set_defaults(func=bench_nodes)
+
+    engine_parser = subparsers.add_parser("engine", help="time StoryEngine making choices")
+    engine_parser.add_argument("--nodes", type=int, nargs="+", default=[100000],
+                               help="sizes of generated stories to play, in nodes")
+    engine_parser.add_argument("--steps", type=int, default=1000000, help="choices made per run")
+    engine_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    engine_parser.set_defaults(func=bench_engine)
+
+    frames_parser = subparsers.add_parser("frames", help="time TypewriterText.update and draw per frame")
+    frames_parser.add_argument("--lengths", type=int, nargs="+", default=[100, 10000, 1000000],
+                               help="text lengths in characters")
+    frames_parser.add_argument("--fonts", nargs="+", default=[f"{PRIMARY_FONT}:24", "default:18"],
+                               help='fonts as "name:size"; "default" is pygame\'s own font')
+    frames_parser.add_argument("--markup", type=float, nargs="+", default=[0.0, 0.3],
+                               help="share of words wrapped in markup tags, from 0 to 1")
+    frames_parser.add_argument("--scroll", nargs="+", choices=["top", "middle", "end"],
+                               default=["top", "middle", "end"],
+                               help="where typing starts: at the top, halfway through, or all typed")
+    frames_parser.add_argument("--mode", choices=["clip", "reflow"], default="clip",
+                               help="the typewriter's reveal mode")
+    frames_parser.add_argument("--frames", type=int, default=300, help="frames per measurement")
+    frames_parser.add_argument("--chars-per-second", type=float, default=120, help="typing speed")
+    frames_parser.add_argument("--json", metavar="FILE", help="also save the results as JSON to FILE")
+    frames_parser.set_defaults(func=bench_frames)
+
+    prefetch_parser = subparsers.add_parser("prefetch", help="check and time showing prefetched story text")
+    prefetch_parser.add_argument("--widths", type=int, nargs="+", default=[760, 400],
+                                 help="widths of the text area in pixels")
+    prefetch_parser.set_defaults(func=bench_prefetch)
+
+    dirty_parser = subparsers.add_parser("dirty", help="check that dirty-rect frames match full redraws")
+    dirty_parser.add_argument("--fonts", nargs="+", default=[f"{PRIMARY_FONT}:24", "default:18"],
+                              help='fonts as "name:size"; the name can also be a font file')
+    dirty_parser.add_argument("--length", type=int, default=1500, help="passage length in characters")
+    dirty_parser.add_argument("--frames", type=int, default=700, help="frames per font and mode")
+    dirty_parser.add_argument("--chars-per-frame", type=int, default=2, help="characters typed per frame")
+    dirty_parser.set_defaults(func=bench_dirty)
+
+    idle_parser = subparsers.add_parser("idle", help="measure CPU time and wakeups while waiting for a key")
+    idle_parser.add_argument("--seconds", type=float, default=10, help="time idle per strategy")
+    idle_parser.set_defaults(func=bench_idle)
+
+    args = parser.parse_args()
+    pygame.init()
+    status = args.func(args)
+    pygame.quit()
+    return status or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
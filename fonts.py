@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Finds font files by name without searching the system fonts every time.
+
+pygame.font.SysFont builds a list of every installed font the first time it
+is called; on Linux that means running fc-list, which can take a large part
+of the game's startup. Here a font name is resolved in this order:
+
+1. A font file bundled with the game in assets/fonts, named after the font
+   in lower case without spaces (e.g. assets/fonts/couriernew.ttf).
+2. The font cache, assets/cache/fonts.json, which remembers the file each
+   name was resolved to last time.
+3. pygame.font.match_font, the search SysFont uses. Its answer is saved in
+   the font cache.
+
+The cache is thrown away whenever a system font folder or the fontconfig
+configuration changes, so newly installed or removed fonts are noticed.
+Fonts that can't be found fall back to pygame's default font, as with SysFont.
+"""
+
+import json
+import os
+
+import pygame
+
+from atomic_file import atomic_path
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# Font files shipped with the game
+BUNDLED_FONTS_DIR = os.path.join(ASSETS_DIR, "fonts")
+BUNDLED_FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+# Where resolved font paths are remembered. Delete it to search again.
+FONT_CACHE_FILE = os.path.join(ASSETS_DIR, "cache", "fonts.json")
+
+# Folders and files whose changes mean the installed fonts may have changed:
+# the font folders of each platform and fontconfig's configuration and caches
+FONT_STATE_PATHS = (
+    "/etc/fonts/fonts.conf",
+    "/etc/fonts/conf.d",
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    "/var/cache/fontconfig",
+    "~/.fonts",
+    "~/.local/share/fonts",
+    "~/.cache/fontconfig",
+    "~/.config/fontconfig",
+    "/Library/Fonts",
+    "/System/Library/Fonts",
+    "~/Library/Fonts",
+    "$WINDIR/Fonts",
+    "$LOCALAPPDATA/Microsoft/Windows/Fonts",
+    "$FONTCONFIG_FILE",
+)
+
+
+def normalize_name(name):
+    """Returns a font name the way pygame compares them: lower case, letters and digits only."""
+    return "".join(char for char in name.lower() if char.isalnum())
+
+
+def get_font_state():
+    """
+    Returns a fingerprint of the installed fonts: the modification time of
+    every path in FONT_STATE_PATHS that exists.
+    """
+    state = []
+    for path in FONT_STATE_PATHS:
+        path = os.path.expanduser(os.path.expandvars(path))
+        if "$" in path:
+            continue  # The environment variable isn't set
+        try:
+            state.append(f"{path}:{os.stat(path).st_mtime_ns}")
+        except OSError:
+            continue
+    return "|".join(state)
+
+
+def find_bundled_font(name):
+    """Returns the path of a font file for `name` in BUNDLED_FONTS_DIR, or None."""
+    for extension in BUNDLED_FONT_EXTENSIONS:
+        path = os.path.join(BUNDLED_FONTS_DIR, normalize_name(name) + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+# --- FontResolver Class (Remembers where each font file is) ---
+class FontResolver:
+    """
+    Resolves font names to font files, remembering the answers on disk in a
+    cache file that is only trusted while the installed fonts stay the same.
+    """
+    def __init__(self, cache_file=FONT_CACHE_FILE):
+        """
+        Initializes the FontResolver object.
+
+        Args:
+            cache_file (str): Path of the JSON file the answers are saved in.
+        """
+        self.cache_file = cache_file
+        self.state = get_font_state()
+        self.paths = {}   # Normalized font name -> font file path, or None if not installed
+        self.hits = 0
+        self.misses = 0
+        self.load_cache()
+
+    def load_cache(self):
+        """Reads the cache file, if there is one for the current font state."""
+        try:
+            with open(self.cache_file, encoding="utf-8") as cache:
+                saved = json.load(cache)
+        except (OSError, ValueError):
+            return
+        if isinstance(saved, dict) and saved.get("state") == self.state and isinstance(saved.get("fonts"), dict):
+            self.paths = saved["fonts"]
+
+    def save_cache(self):
+        """Writes the answers to the cache file. Failing to write it is not an error."""
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with atomic_path(self.cache_file) as temp_path, open(temp_path, "w", encoding="utf-8") as cache:
+                json.dump({"state": self.state, "fonts": self.paths}, cache, indent=4)
+        except OSError as e:
+            print(f"Warning: Could not save the font cache. Error: {e}")
+
+    def resolve(self, name):
+        """
+        Returns the path of the font file for `name`, or None if the font
+        isn't installed.
+        """
+        bundled = find_bundled_font(name)
+        if bundled is not None:
+            return bundled
+
+        key = normalize_name(name)
+        if key in self.paths:
+            path = self.paths[key]
+            if path is None or os.path.isfile(path):
+                self.hits += 1
+                return path
+
+        # Not cached, or the file has gone: search the system fonts
+        self.misses += 1
+        path = pygame.font.match_font(name)
+        self.paths[key] = path
+        self.save_cache()
+        return path
+
+    def load(self, name, size):
+        """Returns a pygame Font for `name` at `size`, or pygame's default font if it isn't installed."""
+        return pygame.font.Font(self.resolve(name), size)
+
+
+_shared_resolver = None
+
+
+def get_font_resolver():
+    """Returns the font resolver shared by the whole game."""
+    global _shared_resolver
+    if _shared_resolver is None:
+        _shared_resolver = FontResolver()
+    return _shared_resolver
+
+
+def load_font(name, size):
+    """Loads a font by name through the shared resolver. Use it in place of pygame.font.SysFont."""
+    return get_font_resolver().load(name, size)
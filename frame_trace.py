@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Records how long each part of every frame takes, for viewing in a trace
+viewer such as chrome://tracing or https://ui.perfetto.dev.
+
+The game loop marks the end of each of its phases; every mark closes a span
+that started at the previous mark. Spans are kept in a ring buffer, so only
+the most recent TRACE_CAPACITY are kept however long the game runs, and are
+written out as Chrome Trace Event JSON when the game exits.
+"""
+
+import json
+import time
+from collections import deque
+
+from atomic_file import atomic_path
+
+# Default file the trace is saved to
+TRACE_FILE = "trace.json"
+
+# Most spans kept; older ones are dropped. At about eight spans per frame
+# this is a little over three minutes of play at 60 frames per second.
+TRACE_CAPACITY = 100000
+
+
+# --- FrameTracer Class (Records spans of the game loop) ---
+class FrameTracer:
+    """
+    Records named spans of time into a ring buffer. A disabled tracer
+    records nothing, so the game loop can mark its phases either way.
+    """
+    def __init__(self, enabled=True, capacity=TRACE_CAPACITY):
+        """
+        Initializes the FrameTracer object.
+
+        Args:
+            enabled (bool): Whether spans are recorded.
+            capacity (int): The most spans kept.
+        """
+        self.enabled = enabled
+        self.spans = deque(maxlen=capacity)   # (name, start, end, frame, args)
+        self.metadata = {}                    # Saved with the trace, e.g. counters
+        self.start = time.perf_counter()
+        self.last_mark = self.start
+        self.frame = 0
+
+    def now(self):
+        """Returns the current time, for starting a span passed to span()."""
+        return time.perf_counter()
+
+    def mark(self, name):
+        """Records the time since the last mark as a span called `name`."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.spans.append((name, self.last_mark, now, self.frame, None))
+        self.last_mark = now
+
+    def span(self, name, start, args=None):
+        """
+        Records a span from `start` (a time from now()) until now. Spans can
+        lie inside the ones recorded by mark().
+
+        Args:
+            name (str): The name of the span.
+            start (float): When the span started.
+            args (dict, optional): Extra details shown with the span.
+        """
+        if self.enabled:
+            self.spans.append((name, start, time.perf_counter(), self.frame, args))
+
+    def end_frame(self):
+        """Counts a frame. Each span is saved with the number of its frame."""
+        if self.enabled:
+            self.frame += 1
+
+    def get_events(self):
+        """Returns the recorded spans as Chrome trace events."""
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "game loop"}}]
+        for name, start, end, frame, args in self.spans:
+            event_args = {"frame": frame}
+            if args:
+                event_args.update(args)
+            events.append({
+                "name": name, "cat": "frame", "ph": "X", "pid": 1, "tid": 1,
+                "ts": round((start - self.start) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "args": event_args,
+            })
+        return events
+
+    def save(self, path=TRACE_FILE):
+        """Writes the recorded spans to `path` as Chrome Trace Event JSON."""
+        with atomic_path(path) as temp_path, open(temp_path, "w", encoding="utf-8") as trace_file:
+            json.dump({"traceEvents": self.get_events(), "displayTimeUnit": "ms", "metadata": self.metadata},
+                      trace_file)
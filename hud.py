@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+A performance overlay for the game, toggled with F3.
+
+Shows the frame rate, a sparkline of recent frame times, how long each part
+of the frame takes, the hit rates of the text rendering caches and the number
+of memory blocks Python has allocated.
+
+The overlay is rendered onto a surface of its own a few times per second,
+from averages over that time, so drawing it each frame is a single blit and
+it barely changes the frame times it shows.
+"""
+
+import sys
+import time
+from collections import deque
+
+import pygame
+
+# Parts of a frame that are timed, in the order they happen
+HUD_PHASES = ("update", "draw", "choices", "hud", "flip")
+
+# Number of frame times shown in the sparkline
+HUD_HISTORY = 120
+
+# How often the overlay is rendered again, in milliseconds
+HUD_REFRESH_MS = 250
+
+# Colors
+HUD_BACKGROUND = (20, 20, 30)
+HUD_TEXT = (220, 220, 220)
+HUD_GRAPH = (0, 255, 255)
+HUD_TARGET = (90, 90, 90)
+
+# Frame time of the game's 60 frames per second, drawn as a line on the sparkline
+TARGET_FRAME_MS = 1000 / 60
+
+# Height of the sparkline in pixels
+SPARKLINE_HEIGHT = 40
+
+
+# --- PerformanceHUD Class (Times the frame and shows the results) ---
+class PerformanceHUD:
+    """
+    Times the parts of each frame and draws them in a corner of the screen.
+
+    The game loop calls start_frame() once it has handled the events, mark()
+    after each part of the frame named in HUD_PHASES and end_frame() before
+    it waits for the next frame. Time is measured even while the overlay is
+    hidden; the overlay is only rendered while it is visible.
+    """
+    def __init__(self, font, pos, caches=None, width=240):
+        """
+        Initializes the PerformanceHUD object.
+
+        Args:
+            font (pygame.font.Font): The font used for the overlay's text.
+            pos (tuple): The (x, y) position of the overlay's top-right corner.
+            caches (dict, optional): Name -> cache with a stats() method
+                returning "hits" and "misses", whose hit rates are shown.
+            width (int): The width of the overlay in pixels.
+        """
+        self.font = font
+        self.caches = caches or {}
+        self.visible = False
+        self.changed = False
+        self.frame_times = deque(maxlen=HUD_HISTORY)   # Milliseconds between frame starts
+        self.phase_totals = dict.fromkeys(HUD_PHASES, 0.0)
+        self.window_frames = 0
+        self.frame_start = None
+        self.last_mark = None
+        self.last_refresh = 0.0
+        self.cache_counts = {name: (0, 0) for name in self.caches}
+        height = (len(HUD_PHASES) + 2 + len(self.caches)) * font.get_linesize() + SPARKLINE_HEIGHT + 12
+        self.panel = pygame.Surface((width, height))
+        self.rect = self.panel.get_rect(topright=pos)
+
+    def toggle(self):
+        """Shows or hides the overlay."""
+        self.visible = not self.visible
+        if self.visible:
+            self.refresh()
+
+    def start_frame(self):
+        """Called at the start of each frame's work."""
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append((now - self.frame_start) * 1000)
+        self.frame_start = now
+        self.last_mark = now
+
+    def mark(self, phase):
+        """Adds the time since the last mark (or the start of the frame) to `phase`."""
+        now = time.perf_counter()
+        self.phase_totals[phase] += now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        """Called when the frame's work is done; renders the overlay again when it's due."""
+        self.window_frames += 1
+        if self.visible and (self.last_mark - self.last_refresh) * 1000 >= HUD_REFRESH_MS:
+            self.refresh()
+
+    def get_idle_timeout(self, timeout):
+        """
+        Returns how long the game loop may sleep waiting for events while
+        keeping the overlay live, given the timeout it would use otherwise
+        (0 for no timeout).
+        """
+        if not self.visible:
+            return timeout
+        return min(timeout, HUD_REFRESH_MS) if timeout else HUD_REFRESH_MS
+
+    def get_cache_rates(self):
+        """
+        Returns the hit rate of each cache since the last call, as a
+        percentage, or None for caches that weren't used.
+        """
+        rates = {}
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            old_hits, old_misses = self.cache_counts[name]
+            hits = stats["hits"] - old_hits
+            lookups = hits + stats["misses"] - old_misses
+            self.cache_counts[name] = (stats["hits"], stats["misses"])
+            rates[name] = hits / lookups * 100 if lookups else None
+        return rates
+
+    def refresh(self):
+        """Renders the overlay from the times measured since the last refresh."""
+        frames = max(1, self.window_frames)
+        recent = list(self.frame_times)[-frames:]
+        frame_ms = sum(recent) / len(recent) if recent else 0.0
+        fps = 1000 / frame_ms if frame_ms else 0.0
+
+        lines = [f"FPS {fps:6.1f}   frame {frame_ms:6.2f} ms"]
+        for phase in HUD_PHASES:
+            lines.append(f"{phase:<8} {self.phase_totals[phase] / frames * 1000:7.3f} ms")
+        for name, rate in self.get_cache_rates().items():
+            rate_text = "   -" if rate is None else f"{rate:5.1f}%"
+            lines.append(f"{name:<8} {rate_text} hits")
+        lines.append(f"heap     {sys.getallocatedblocks():,} blocks")
+
+        self.panel.fill(HUD_BACKGROUND)
+        line_spacing = self.font.get_linesize()
+        y = 6
+        for line in lines:
+            self.panel.blit(self.font.render(line, True, HUD_TEXT), (6, y))
+            y += line_spacing
+        self.draw_sparkline(pygame.Rect(6, y + 4, self.rect.width - 12, SPARKLINE_HEIGHT))
+
+        self.phase_totals = dict.fromkeys(HUD_PHASES, 0.0)
+        self.window_frames = 0
+        self.last_refresh = time.perf_counter()
+        self.changed = True
+
+    def draw_sparkline(self, area):
+        """Draws the recent frame times as a line graph in `area` of the panel."""
+        scale = max(2 * TARGET_FRAME_MS, max(self.frame_times, default=0))
+        target_y = area.bottom - round(TARGET_FRAME_MS / scale * area.height)
+        pygame.draw.line(self.panel, HUD_TARGET, (area.left, target_y), (area.right, target_y))
+        if len(self.frame_times) < 2:
+            return
+        step = area.width / (HUD_HISTORY - 1)
+        points = [(area.left + round(i * step), area.bottom - round(frame_ms / scale * area.height))
+                  for i, frame_ms in enumerate(self.frame_times)]
+        pygame.draw.lines(self.panel, HUD_GRAPH, False, points)
+
+    def draw(self, surface):
+        """Blits the overlay onto `surface` and returns the area it covers."""
+        surface.blit(self.panel, self.rect)
+        self.changed = False
+        return self.rect
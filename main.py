@@ -9,13 +9,35 @@ structure that can be easily expanded.
 Controls:
 - 1, 2, 3...: Make a choice
 - SPACE:      Skip the current text animation
+- F3:         Show or hide the performance overlay
 - F4:         Toggle fullscreen mode
 - F1 / ESC:   Quit the game
+
+Run with --trace [FILE] to record how long each part of every frame takes
+and save it as a Chrome trace (trace.json by default) on exit, or with
+--profile-startup to show the first frame, print where the startup time
+went and quit.
 """
 
-import pygame
-import sys
-import os
+# Taken before the other imports so --profile-startup can time them, which
+# is why they are all marked noqa: E402
+import time
+IMPORT_START = time.perf_counter()
+
+import argparse  # noqa: E402
+import pygame  # noqa: E402
+import sys  # noqa: E402
+
+from audio import AudioStarter, TypingAudio  # noqa: E402
+from fonts import load_font  # noqa: E402
+from frame_trace import TRACE_FILE, FrameTracer  # noqa: E402
+from hud import PerformanceHUD  # noqa: E402
+from markup import TextStyle, parse_markup  # noqa: E402
+from prefetch import Prefetcher  # noqa: E402
+from startup import StartupProfile  # noqa: E402
+from story import StoryEngine, StoryError, load_story  # noqa: E402
+from text_layout import IncrementalWrapper, TextLayout  # noqa: E402
+from text_render import get_glyph_atlas, get_line_cache  # noqa: E402
 
 # --- Constants ---
 # Screen dimensions
@@ -32,25 +54,52 @@ GREY = (150, 150, 150)
 # Fonts
 PRIMARY_FONT = "Courier New"
 
+# Sound
+# "clicks" plays a synthesized key click for each typed character;
+# "recording" loops a short clip of the recorded typing sound instead.
+TYPING_SOUND = "clicks"
+
+# Idle waiting
+# Video drivers without a native event wait: pygame.event.wait checks for
+# events every millisecond on these. Measured with "python benchmark.py idle":
+# about 970 wakeups and 17 ms of CPU per second, against 150 and 7 ms when
+# polling at 60 FPS, so the game keeps polling on them.
+POLLING_VIDEO_DRIVERS = ("dummy", "offscreen")
+
+# Rendering
+# When enabled, only the parts of the screen that changed are redrawn and
+# pushed to the display instead of the whole frame.
+USE_DIRTY_RECTS = True
+
 # --- TypewriterText Class (Handles text display and animation) ---
 class TypewriterText:
     """
     Manages rendering text with a typewriter effect, including word wrapping,
-    scrolling, sound, and simple text formatting.
+    scrolling, sound, and text formatting written in the markup described in
+    markup.py (e.g. "[red]14 years[/red]").
     """
-    def __init__(self, text, font, pos, max_width, max_height, delay=25, color=WHITE, sound=None):
+    def __init__(self, text, font, pos, max_width, max_height, delay=25, color=WHITE, sound=None,
+                 reveal_mode="clip", line_cache=None, clicks=None):
         """
         Initializes the TypewriterText object.
 
         Args:
-            text (str): The full text to be displayed.
+            text (str): The full text to be displayed. May contain markup.
             font (pygame.font.Font): The font used for rendering text.
             pos (tuple): The (x, y) position of the top-left corner of the text area.
             max_width (int): The maximum width for a line of text before wrapping.
             max_height (int): The maximum height of the text display area.
-            delay (int): Milliseconds between each character appearing.
+            delay (float): Milliseconds between each character appearing. May be
+                shorter than a frame; several characters then appear per frame.
             color (tuple): The RGB color of the text.
             sound (pygame.mixer.Sound, optional): Sound to play for each character.
+            reveal_mode (str): "clip" lays the text out once, line by line as
+                it comes into view, and uncovers each pre-rendered line as it
+                is typed; "reflow" re-wraps the revealed text as it grows.
+            line_cache (LineSurfaceCache, optional): Cache for rendered lines.
+                Defaults to the cache shared by every TypewriterText.
+            clicks (KeyClicks, optional): Key clicks to play as characters are
+                typed, instead of looping `sound`.
         """
         self.font = font
         self.pos = pos
@@ -58,35 +107,85 @@ class TypewriterText:
         self.max_height = max_height
         self.delay = delay
         self.color = color
-        self.sound = sound
-        self.typing_channel = pygame.mixer.Channel(1) if self.sound else None
+        self.audio = TypingAudio(sound, clicks)
         self.full_text = ""
+        self.styled = None
+        self.plain_style = TextStyle(color, False, False, False)
         self.current_index = 0
         self.last_update = 0
+        self.reveal_mode = reveal_mode
+        self.atlas = get_glyph_atlas()
+        self.line_cache = line_cache if line_cache is not None else get_line_cache()
+        self.wrapper = IncrementalWrapper(font, max_width)
+        self.layout = None
+        self.visible_lines = {}   # Line start -> (runs, surface) of the lines on screen
+        self.window = ([], True)
+        self.last_drawn = None
         self.set_text(text)
 
-    def set_text(self, text):
-        """Resets the typewriter with new text."""
-        self.full_text = text
+    def set_text(self, text, prepared=None):
+        """
+        Resets the typewriter with new text. The markup is parsed here, once.
+
+        Args:
+            text (str): The new text. May contain markup.
+            prepared (tuple, optional): (StyledText, TextLayout) of `text`,
+                made ahead of time for this typewriter by a Prefetcher.
+        """
+        if prepared is not None:
+            self.styled, layout = prepared
+        else:
+            self.styled, layout = parse_markup(text, self.color), None
+        self.full_text = self.styled.text
         self.current_index = 0
         self.last_update = pygame.time.get_ticks()
-        if self.typing_channel:
-            self.typing_channel.stop()
+        self.last_drawn = None
+        if self.reveal_mode == "clip":
+            if layout is None:
+                layout = TextLayout(self.full_text, self.font, self.max_width)
+            self.layout = layout
+            self.visible_lines = {}
+            self.window = ([], True)
+        else:
+            self.wrapper.reset(self.full_text)
+        self.audio.finished()
+
+    def set_sound(self, sound):
+        """Sets the sound played while typing. None turns the sound off."""
+        self.audio.set_sound(sound)
+
+    def set_clicks(self, clicks):
+        """Sets the key clicks played while typing. None turns them off."""
+        self.audio.set_clicks(clicks)
+
+    def set_chars_per_second(self, chars_per_second):
+        """Sets the typing speed in characters per second."""
+        self.delay = 1000 / chars_per_second
 
-    def play_typing_sound(self):
-        """Plays the typing sound if it's not already playing."""
-        if self.sound and self.typing_channel and not self.typing_channel.get_busy():
-            self.typing_channel.play(self.sound)
+    def get_chars_per_second(self):
+        """Returns the typing speed in characters per second."""
+        return 1000 / self.delay
 
     def update(self):
-        """Updates the visible text based on the time elapsed."""
+        """
+        Updates the visible text based on the time elapsed. As many characters
+        are revealed as fit in the elapsed time, so the typing speed doesn't
+        depend on the frame rate; the leftover time is carried to the next call.
+        """
         now = pygame.time.get_ticks()
-        if not self.is_finished() and now - self.last_update > self.delay:
-            self.last_update = now
-            self.current_index += 1
-            self.play_typing_sound()
-        if self.is_finished() and self.typing_channel:
-            self.typing_channel.stop()
+        if not self.is_finished():
+            if self.delay <= 0:
+                self.complete()
+                return
+            steps = int((now - self.last_update) // self.delay)
+            if steps > 0:
+                self.last_update += steps * self.delay
+                self.current_index = min(self.current_index + steps, len(self.full_text))
+                # Characters revealed in the same frame would click at the
+                # same instant, so the last of them stands for them all
+                self.audio.typed(self.full_text[self.current_index - 1])
+        if self.is_finished():
+            self.audio.finished()
 
     def wrap_text(self, text):
         """Wraps a string of text to fit within the max_width."""
@@ -109,48 +208,105 @@ class TypewriterText:
             wrapped_lines.append(current_line)
         return wrapped_lines
 
-    def draw_line_with_formatting(self, surface, line, base_x, y, center=False):
+    def get_window(self):
         """
-        Draws a single line of text, handling special formatting.
-        Currently hardcoded to color "14 years" in red.
+        Returns the laid-out lines that are on screen as (start, end) offsets,
+        ending with the line the cursor is on, together with the Y position of
+        the first one.
         """
-        if "14 years" in line:
-            segments = line.split("14 years")
-            rendered_segments = [self.font.render(seg, True, self.color) for seg in segments]
-            red_segment = self.font.render("14 years", True, RED)
-            
-            total_width = sum(seg.get_width() for seg in rendered_segments) + red_segment.get_width() * (len(segments) - 1)
-            
-            current_x = base_x
-            if center:
-                current_x = base_x + (self.max_width - total_width) // 2
-
-            for i, seg_surface in enumerate(rendered_segments):
-                surface.blit(seg_surface, (current_x, y))
-                current_x += seg_surface.get_width()
-                if i < len(segments) - 1:
-                    surface.blit(red_segment, (current_x, y))
-                    current_x += red_segment.get_width()
+        lines, at_top = self.window
+        # The window only changes when the cursor leaves its current line
+        if not (lines and lines[-1][0] <= self.current_index <= lines[-1][1]):
+            line_spacing = self.font.get_linesize()
+            rows = max(1, self.max_height // line_spacing)
+            self.window = self.layout.window(self.current_index, rows)
+            lines, at_top = self.window
+
+        # Scroll so the cursor line stays visible once the text fills the area
+        start_y = self.pos[1]
+        if not at_top:
+            start_y = self.pos[1] + self.max_height - len(lines) * self.font.get_linesize()
+        return lines, start_y
+
+    def get_visible_line(self, start, end):
+        """Returns the (runs, surface) of an on-screen line of the layout."""
+        line = self.visible_lines.get(start)
+        if line is None:
+            runs = self.styled.runs(start, end)
+            line = self.visible_lines[start] = (runs, self.get_line_surface(runs))
+        return line
+
+    def is_heading(self, start, end):
+        """Returns True if a line is the chapter heading, which is centered."""
+        first_line_start = self.layout.paragraph_lines(0, 0)[0]
+        return start == first_line_start and self.full_text[start:end].strip().startswith("Chapter")
+
+    def get_wrapped_runs(self, line, start):
+        """Returns the (text, style) runs of a re-wrapped line starting at `start`."""
+        if start is None:
+            return [(line, self.plain_style)]
+        return self.styled.runs(start, start + len(line))
+
+    def render_line(self, runs):
+        """Renders a single line of (text, style) runs to a new surface."""
+        width = self.atlas.runs_width(self.font, runs)
+        rendered = pygame.Surface((width, self.font.get_linesize()), pygame.SRCALPHA)
+        self.atlas.draw_runs(rendered, self.font, runs, (0, 0))
+        return rendered
+
+    def get_line_surface(self, runs):
+        """Returns the rendered surface for a line, from the line cache if possible."""
+        key = (self.font, tuple(runs))
+        rendered = self.line_cache.get(key)
+        if rendered is None:
+            rendered = self.render_line(runs)
+            self.line_cache.put(key, rendered)
+        return rendered
+
+    def draw_line_with_formatting(self, surface, runs, base_x, y, center=False, cached=False):
+        """
+        Draws a single line of (text, style) runs. Lines that won't change any
+        more can be drawn from the line cache with `cached`.
+        """
+        if cached:
+            rendered = self.get_line_surface(runs)
+            width = rendered.get_width()
         else:
-            rendered = self.font.render(line, True, self.color)
-            x = base_x
-            if center:
-                x = base_x + (self.max_width - rendered.get_width()) // 2
+            width = self.atlas.runs_width(self.font, runs)
+
+        x = base_x
+        if center:
+            x = base_x + (self.max_width - width) // 2
+        if cached:
             surface.blit(rendered, (x, y))
+        else:
+            self.atlas.draw_runs(surface, self.font, runs, (x, y))
+
+    def get_scroll_y(self, line_count):
+        """Returns the Y position of the first line so the newest line stays visible."""
+        line_spacing = self.font.get_linesize()
+        total_text_height = line_count * line_spacing
+        start_y = self.pos[1]
+        if total_text_height > self.max_height:
+            start_y = self.pos[1] + self.max_height - total_text_height
+        return start_y
 
     def draw(self, surface):
         """Renders the typewriter text and cursor onto the given surface."""
-        current_text_segment = self.full_text[:self.current_index]
-        lines = self.wrap_text(current_text_segment)
-        line_spacing = self.font.get_linesize()
+        if self.reveal_mode == "clip":
+            self.draw_clipped(surface)
+        else:
+            self.draw_reflowed(surface)
 
-        total_text_height = len(lines) * line_spacing
+    def draw_reflowed(self, surface):
+        """Draws the revealed text by re-wrapping it as it grows."""
+        lines = self.wrapper.wrap(self.current_index)
+        starts = self.wrapper.line_starts(self.current_index)
+        line_spacing = self.font.get_linesize()
         x, y_start_area = self.pos
 
         # Calculate starting Y position to create a scrolling effect
-        start_y = y_start_area
-        if total_text_height > self.max_height:
-            start_y = y_start_area + self.max_height - total_text_height
+        start_y = self.get_scroll_y(len(lines))
 
         # Draw each visible line
         for i, line in enumerate(lines):
@@ -159,54 +315,190 @@ class TypewriterText:
             # Only draw lines that are within the visible text area
             if y_start_area <= line_y < y_start_area + self.max_height:
                 center_line = (i == 0 and line.strip().startswith("Chapter"))
-                self.draw_line_with_formatting(surface, line, x, line_y, center_line)
+                # Every line but the last one is complete and can come from the cache
+                completed = i < len(lines) - 1 or self.is_finished()
+                runs = self.get_wrapped_runs(line, starts[i])
+                self.draw_line_with_formatting(surface, runs, x, line_y, center_line, cached=completed)
                 
         # Draw blinking cursor at the end of the text
         if not self.is_finished() and (pygame.time.get_ticks() // 500) % 2 == 0:
             last_line_text = lines[-1] if lines else ""
-            cursor_x = x + self.font.size(last_line_text)[0]
+            last_line_runs = self.get_wrapped_runs(last_line_text, starts[-1] if starts else None)
+            cursor_x = x + self.atlas.runs_width(self.font, last_line_runs)
             cursor_y = start_y + (len(lines) - 1) * line_spacing
             
             if y_start_area <= cursor_y < y_start_area + self.max_height:
-                surface.blit(self.font.render('_', True, self.color), (cursor_x, cursor_y))
+                self.atlas.draw(surface, self.font, self.color, '_', (cursor_x, cursor_y))
+
+    def draw_clipped(self, surface):
+        """
+        Draws the revealed text from the layout. Only the lines on screen are
+        visited; each is rendered once and only the part that has been typed so
+        far is blitted.
+        """
+        line_spacing = self.font.get_linesize()
+        x = self.pos[0]
+        lines, start_y = self.get_window()
+
+        # Forget the surfaces of lines that scrolled out of view
+        if len(self.visible_lines) > len(lines):
+            on_screen = {start for start, _end in lines}
+            for start in list(self.visible_lines):
+                if start not in on_screen:
+                    del self.visible_lines[start]
+
+        cursor_x = x
+        for i, (start, end) in enumerate(lines):
+            line_y = start_y + i * line_spacing
+            runs, rendered = self.get_visible_line(start, end)
+
+            line_x = x
+            if self.is_heading(start, end):
+                line_x = x + (self.max_width - rendered.get_width()) // 2
+
+            if self.current_index >= end:
+                revealed_width = rendered.get_width()
+            else:
+                revealed_width = self.atlas.runs_width(self.font, runs, self.current_index - start)
+            surface.blit(rendered, (line_x, line_y), pygame.Rect(0, 0, revealed_width, rendered.get_height()))
+            cursor_x = line_x + revealed_width
+
+        # Draw blinking cursor at the end of the revealed text
+        if not self.is_finished() and (pygame.time.get_ticks() // 500) % 2 == 0:
+            cursor_y = start_y + (len(lines) - 1) * line_spacing
+            self.atlas.draw(surface, self.font, self.color, '_', (cursor_x, cursor_y))
+
+    def get_area_rect(self):
+        """Returns the screen area the typewriter can draw into."""
+        cursor_width = self.atlas.glyph(self.font, self.plain_style, '_')[1].width
+        return pygame.Rect(self.pos[0], self.pos[1],
+                           self.max_width + cursor_width, self.max_height + self.font.get_linesize())
+
+    def is_cursor_visible(self):
+        """Returns True if the blinking cursor is currently shown."""
+        return not self.is_finished() and (pygame.time.get_ticks() // 500) % 2 == 0
+
+    def get_cursor_rect(self):
+        """
+        Returns the cell the cursor occupies, i.e. where the next character will
+        appear, together with a value that changes whenever the text scrolls.
+        """
+        x = self.pos[0]
+        if self.reveal_mode == "clip":
+            lines, start_y = self.get_window()
+            cursor_line = len(lines) - 1
+            start, end = lines[-1]
+            runs, rendered = self.get_visible_line(start, end)
+            if self.is_heading(start, end):
+                x += (self.max_width - rendered.get_width()) // 2
+            revealed_width = self.atlas.runs_width(self.font, runs, max(0, self.current_index - start))
+            scroll = (start_y, lines[0][0])
+        else:
+            lines = self.wrapper.wrap(self.current_index)
+            starts = self.wrapper.line_starts(self.current_index)
+            cursor_line = len(lines) - 1
+            start_y = self.get_scroll_y(len(lines))
+            last_line_runs = self.get_wrapped_runs(lines[-1], starts[-1]) if lines else []
+            revealed_width = self.atlas.runs_width(self.font, last_line_runs)
+            scroll = start_y
+
+        # The '_' glyph can be taller than a line (29 px in 28 px lines with
+        # DejaVu Sans Mono 24), so the cell covers all of it
+        line_spacing = self.font.get_linesize()
+        cursor_area = self.atlas.glyph(self.font, self.plain_style, '_')[1]
+        cursor_rect = pygame.Rect(x + revealed_width,
+                                  start_y + cursor_line * line_spacing,
+                                  cursor_area.width, max(line_spacing, cursor_area.height))
+        return cursor_rect, scroll
+
+    def get_idle_timeout(self):
+        """
+        Returns how many milliseconds can pass before the typewriter needs to be
+        updated and drawn again: the next character or cursor blink, whichever
+        comes first. Returns 0 if it won't change again until new text is set.
+        """
+        if self.is_finished():
+            return 0
+        now = pygame.time.get_ticks()
+        next_blink = 500 - now % 500
+        next_char = self.last_update + self.delay - now
+        return max(1, int(min(next_blink, next_char)) + 1)
+
+    def get_dirty_rects(self):
+        """
+        Returns the screen areas that changed since the last call: the newly
+        revealed text and the cursor cell, or the whole text area after new text
+        was set or the text scrolled. Returns an empty list if nothing changed.
+        """
+        area = self.get_area_rect()
+        cursor_rect, scroll = self.get_cursor_rect()
+        cursor_visible = self.is_cursor_visible()
+        drawn = (self.current_index, cursor_rect, scroll, cursor_visible)
+        last_drawn, self.last_drawn = self.last_drawn, drawn
+
+        if last_drawn is None or last_drawn[2] != scroll:
+            return [area]
+        last_index, last_cursor_rect, _scroll, last_cursor_visible = last_drawn
+
+        if last_index != self.current_index:
+            if self.reveal_mode == "clip" and last_cursor_rect.y == cursor_rect.y:
+                # Still on the same line: only the new characters and the cursor changed
+                dirty = last_cursor_rect.union(cursor_rect)
+            else:
+                # Lines may have been re-wrapped, so redraw every line in between
+                top = min(last_cursor_rect.y, cursor_rect.y)
+                bottom = max(last_cursor_rect.bottom, cursor_rect.bottom)
+                dirty = pygame.Rect(area.x, top, area.width, bottom - top)
+            return [dirty.clip(area)]
+        if last_cursor_visible != cursor_visible:
+            return [cursor_rect.clip(area)]
+        return []
 
     def complete(self):
         """Instantly finishes the text animation."""
         self.current_index = len(self.full_text)
-        if self.typing_channel:
-            self.typing_channel.stop()
+        self.audio.finished()
 
     def is_finished(self):
         """Returns True if the entire text has been revealed."""
         return self.current_index >= len(self.full_text)
 
+def parse_args(argv=None):
+    """Parses the command line options."""
+    parser = argparse.ArgumentParser(description="A text-based adventure game with a typewriter effect.")
+    parser.add_argument("--trace", nargs="?", const=TRACE_FILE, metavar="FILE",
+                        help=f"save a Chrome trace of the game loop to FILE on exit (default: {TRACE_FILE})")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="show the first frame, print how long each step of startup took and quit")
+    return parser.parse_args(argv)
+
 def main():
     """Main function to initialize Pygame and run the game loop."""
     # --- Game Setup ---
-    pygame.init()
-    pygame.mixer.init()
+    # Only what the first frame needs is started here: pygame.init() would
+    # also open the audio device, which is left to a background thread.
+    profile = StartupProfile(IMPORT_START)
+    profile.step("imports")
+    args = parse_args()
+    pygame.display.init()
+    pygame.font.init()
+    pygame.time.wait(0)  # Starts SDL's timer, which pygame.time.get_ticks needs
+    profile.step("display and font init")
 
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Chapter 1: The Awakening")
     clock = pygame.time.Clock()
-    
-    # Load fonts
-    font = pygame.font.SysFont(PRIMARY_FONT, 24)
-    small_font = pygame.font.SysFont(PRIMARY_FONT, 18)
-
-    # Load typing sound (optional)
-    # Load typing sound (optional)
-    typing_sound = None
-    try:
-        # Create a reliable path to the sound file relative to the script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        sound_path = os.path.join(script_dir, "assets", "mixkit-fast-laptop-keyboard-typing-1392.wav")
-        if os.path.exists(sound_path):
-            typing_sound = pygame.mixer.Sound(sound_path)
-        else:
-            print(f"Warning: Sound file not found at '{sound_path}'.")
-    except pygame.error as e:
-        print(f"Warning: Could not load typing sound. Game will run without it. Error: {e}")
+    # Sleep in pygame.event.wait while waiting for a key, except on drivers
+    # where that polls and costs more than running at 60 FPS
+    wait_when_idle = pygame.display.get_driver() not in POLLING_VIDEO_DRIVERS
+    profile.step("window")
+
+    # Load fonts. The font file is looked up once and remembered on disk
+    # (or bundled in assets/fonts), see fonts.py.
+    font = load_font(PRIMARY_FONT, 24)
+    small_font = load_font(PRIMARY_FONT, 18)
+    hud_font = load_font(PRIMARY_FONT, 14)
+    profile.step("fonts")
 
     # Define text area dimensions
     text_area_rect = pygame.Rect(10, 30, 780, 300)
@@ -215,190 +507,155 @@ def main():
     text_max_height = text_area_rect.height - 2 * text_margin
 
     # --- Story Data ---
-    # The game's story is stored in a dictionary. Each key is a unique node ID.
-    # Each node has 'text' and a list of 'choices'.
-    # The next node's ID is generated from the current ID and the choice index.
+    # The story is loaded from story.json, compiled into story.bin. Each node
+    # has a unique key, a 'text' and a list of 'choices'. The next node's key
+    # is generated from the current key and the choice index,
     # e.g., from node '1', choosing the 2nd option leads to node '1_2'.
-    # Nodes with an empty 'choices' list are endings.
-    initial_story = ("Chapter 1: The Awakening\n\n"
-                     "You are playing a newly released game in a dark, silent room. It's your deserved reward after all.\n"
-                     "You waited 14 years for it. Now it is finally available in your hand. Enjoying it is your virtue.\n"
-                     "But some noise starts coming apart, disturbing your joy in the process.")
-    
-    choices_tree = {
-        "start": {
-            "text": initial_story,
-            "choices": ["Investigate the noise", "Ignore it"]
-        },
-        "1": { # Investigate the noise
-            "text": "You chose to investigate the noise. It becomes more static, giving eerie vibes and it grows louder.\nDo you really want to investigate the sound or call someone?",
-            "choices": ["Yes, these things don't scare me anymore.", "Call someone for help"]
-        },
-        "2": { # Ignore it
-            "text": "You chose to ignore the noise. You enjoy the loading screen and one specific picture.\nNoise from outside starts growing?\nDo you want to investigate the sound or keep playing anyway?",
-            "choices": ["Ahh! So irritating", "Keep playing anyway"]
-        },
-        "1_1": { # Investigate -> Yes, these things don't scare me anymore.
-            "text": "You move forward, braver now. After all, it's your home. If you don't protect it, who will? Bracing yourself, you cross the hallway to the door. There you see your coat hanging on a metal hanger.",
-            "choices": ["Wear coat", "Wear coat and take metal hanger as weapon", "Just enter"]
-        },
-        "1_2": { # Investigate -> Call someone for help
-            "text": "You try to call someone, but there's no signal. You're confused—the signal is always strong in this room.",
-            "choices": ["Investigate the sound by yourself", "Go back and try again with your PC"]
-        },
-        "2_1": { # Ignore -> Ahh! So irritating
-            "text": "You stand up angrily. Irritated by the noise, you grab a nearby flashlight and the beer bottle you were about to enjoy with your game.",
-            "choices": ["Rush the hallway", "Walk the hallway in a normal pace"]
-        },
-        "2_2": { # Ignore -> Keep playing anyway
-            "text": "You keep playing. Now you control the playable character.",
-            "choices": ["Punch an NPC", "Do a mission in the game"]
-        },
-        "1_1_1": { # Investigate -> Yes -> Wear coat
-            "text": "You wear the coat. It feels heavier than usual, but provides a small sense of security. You grip the doorknob. It's strangely cold, almost unnaturally so as you slowly turn it. The noise on the other side stops abruptly. The silence is now even more terrifying than the noise was.",
-            "choices": ["fling the door open.", "Open the door slowly and peek.", "Call out,'Who's there?"]
-        },
-        "1_1_2": { # Investigate -> Yes -> Wear coat and take metal hanger as weapon
-            "text": "You wear the coat and rip the metal hanger off the hook. You bend it into a crude, sharp point. It feels better than nothing. You grip the doorknob. It's strangely cold, almost unnaturally so as you slowly turn it. The noise on the other side stops abruptly.",
-            "choices": ["fling the door open.", "Open the door slowly and peek.", "Call out, 'Who's there?'"]
-        },
-        "1_1_3": { # Investigate -> Yes -> Just enter
-            "text": "You decide to face whatever is there with your undies that you were wearing. You slowly, silently, turn the knob slowly which felt strangely cold and the noise beyond the door stop suddenly.",
-            "choices": ["Push the door fully open.", "Close the door and reconsider."]
-        },
-        "1_2_1": { # Investigate -> Call -> Investigate by yourself
-            "redirect": "1_1" # This redirect effectively takes you to the content of node "1_1"
-        },
-        "1_2_2": { # Investigate -> Call -> Go back and try again with your PC
-            "text": "You decide this is too strange. You go back to your PC, You cancel the game that you were so desperate to play but you didn't download from offical website so you were redirected to a porn site.",
-            "choices": ["Try to close the porn site.", "Enjoy it afterall who is looking?", "Force shutdown the pc"]
-        },
-        "2_1_1": { # Ignore -> Irritated -> Rush the hallway
-            "text": "Fueled by annoyance, you rush down the hallway, flashlight beam bouncing wildly. You round the corner to the hallway and kicks open the door and the light falls on a oddly figure. It's tall, unnaturally thin, and turns its head towards you with an audible crack of neck.",
-            "choices": ["Throw the beer bottle at it.", "Freeze and stare in it eyes."]
-        },
-        "2_1_2": { # Ignore -> Irritated -> Walk the hallway in a normal pace
-            "text": "You walk calmly, flashlight off, using the dim moonlight to see. The noise is a rhythmic scraping coming from the outside of hallway room. You open the door and light falls on a oddly figure. It's tall, unnaturally thin, and turns its head towards you with an audible crack of neck.",
-            "choices": ["Flick on the flashlight to startle it.", "Quietly back away."]
-        },
-        "2_2_1": { # Ignore -> Keep playing -> Punch an NPC
-            "text": "Every start of a game of Gta,we always punch a npc to celebrate the download of the game and so you did it. Keeping the tradition alive.",
-            "choices": ["Punch even more npc?", "Investigate the sound that irritating you?"]
-        },
-        "2_2_2": { # Ignore -> Keep playing -> Do a mission in the game
-            "text": "You ignore the real-world noise and focus on the game. The quest-giver, a mafia, looks at you, but his dialogue box says, 'Gang B is has stolen ours supplies recover it or you dead' The text is bright red",
-            "choices": ["Kill the Npc.", "Ask the NPC a question in-game.","Investigate the sound that irritating you?"]
-        },
-        "1_1_1_1":{ # Investigate -> Yes -> Wear coat -> fling the door open
-            "text": "You throw the door open to an empty living room. You hear rough breathing sound towards a certain direction.",
-            "choices": ["Flash your flashlight towards it.","throw the flashlight at it.","Scream at it."]
-        },
-        "1_1_1_2": { # Investigate -> Yes -> Wear coat -> Open the door slowly and peek
-            "text":"You peek out. Closing your flashlight so you can be like an assassin. You open the door slowly.",
-            "choices": ["Crawl on the surface.","Crouch on the surface and walk","Walk in this situation."]
-        },
-        "1_1_1_3":{ # Investigate -> Yes -> Wear coat -> 'Who's there?
-            "text": "Your voice echoes in the silent house. There is no reply.",
-            "choices": ["Flash your flashlight at random direction","Shout once again","Go back inside"]
-        },
-        "1_1_2_1":{ # Investigate -> Yes -> Wear coat and take metal hanger as weapon ->fling the door open.
-            "text": "You burst through the door with a war cry and enters the living room while flashing the light falls on an oddly figure. It's tall, unnaturally thin, and turns its head towards you with an audible crack of neck.",
-            "choices": ["Flash your flashlight on it.","Throw the nearby chair at it","Try to talk with it"]
-        },
-        "1_1_2_2":{ # Investigate -> Yes -> Wear coat and take metal hanger as weapon -> Open the door slowly and peek.
-            "text": "Holding your makeshift weapon in your hand you cautiously turn the doorknob, peeking through the door as cautiously as possible.\n\nWhat would you do next?",
-            "choices": ["Crawl on the surface.","Crouch on the surface and walk","Walk in this situation."]
-        },
-        "1_1_2_3": { # Investigate -> Yes -> Wear coat and take metal hanger as weapon -> Call out,'Who's there?
-            "text": "After opening the door. You call out by saying, 'Who's there? If you are a thief, you picked the wrong house, mate. I will call the police in a few seconds. You hear me, mate?'",
-            "choices": ["Wait for the response","Start calling the police","Step more forward with your flashlight."]
-        },
-        "1_1_3_1": { # Investigate -> Yes -> Just enter -> Push the door fully open.
-            "text": "You push the door open proudly. You don't need a weapon to respond to such danger or anything. Flashing your light, you see an oddly figure. It's tall and unnaturally thin. Turning its head slowly towards the direction of the light.",
-            "choices": ["'Who are you?' or 'What are you?'","Give a 'War cry'","Just go back inside"]
-        },
-        "1_1_3_2": { # Investigate -> Yes -> Just enter -> Close the door and reconsider.
-            "text": "You got an awakening and finally your one brain cell thought: 'Is it really okay to fight in my undies?'",
-            "choices": ["Wear the coat", "Wear coat and take metal hanger as weapon", "Just enter (again)"]
-        }
-    }
-
-    # --- Game State Variables ---
-    game_state = "narrative"  # Can be 'narrative', 'choice', or 'ending'
-    current_node_key = "start"
-    
+    # Nodes with an empty 'choices' list are endings. See story.py.
+    try:
+        story = load_story()
+    except StoryError as e:
+        print(f"Error: Could not load the story. {e}")
+        pygame.quit()
+        sys.exit(1)
+    profile.step("story")
+
+    # --- Game State ---
+    # The engine keeps track of the story; its state is 'narrative',
+    # 'choice', or 'ending'. This function only shows it and passes on keys.
+    engine = StoryEngine(story)
+
     typewriter = TypewriterText(
-        choices_tree[current_node_key]["text"], font,
+        engine.get_text(), font,
         (text_area_rect.x + text_margin, text_area_rect.y + text_margin),
         text_max_width, text_max_height,
-        delay=30, color=WHITE, sound=typing_sound
+        delay=30, color=WHITE
     )
+    typewriter.audio.set_node(engine.get_node_name())
+
+    # Gets the text behind each choice ready while the player is choosing
+    prefetcher = Prefetcher(typewriter)
+
+    # Performance overlay, shown with F3
+    hud = PerformanceHUD(hud_font, (WIDTH - 10, 10),
+                         {"lines": get_line_cache(), "glyphs": get_glyph_atlas(), "prefetch": prefetcher})
+
+    # Spans of each phase of the game loop, recorded with --trace
+    tracer = FrameTracer(enabled=args.trace is not None)
+    profile.step("typewriter and overlay")
+
+    # Typing sound (optional). Once the first frame is shown, the mixer is
+    # started and the key clicks or the recording prepared on a background
+    # thread; they are handed to the typewriter when they're ready.
+    audio_starter = None
 
     # --- Main Game Loop ---
     running = True
+    full_redraw = True      # Set when the whole screen has to be drawn again
+    drawn_scene = None      # (state, node) shown by the last full redraw
+    first_frame_ms = None   # Time from startup to the first frame
     while running:
         # --- Event Handling ---
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if not events and engine.state in ("choice", "ending") and not full_redraw:
+            if prefetcher.is_busy():
+                # Use the idle time to get the next nodes' text ready
+                prefetch_start = tracer.now()
+                prefetcher.work()
+                tracer.span("prefetch", prefetch_start)
+            elif wait_when_idle:
+                # Nothing changes until the player presses a key, so sleep until an
+                # event arrives (or the typewriter next changes) instead of spinning
+                wait_start = tracer.now()
+                events = [pygame.event.wait(hud.get_idle_timeout(typewriter.get_idle_timeout()))]
+                tracer.span("idle wait", wait_start)
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
+            typewriter.audio.handle_event(event)
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                full_redraw = True
             if event.type == pygame.KEYDOWN:
                 if event.key in (pygame.K_ESCAPE, pygame.K_F1):
                     running = False
+                elif event.key == pygame.K_F3:
+                    hud.toggle()
+                    full_redraw = True
                 elif event.key == pygame.K_F4:
                     pygame.display.toggle_fullscreen()
-                elif event.key == pygame.K_SPACE and game_state == "narrative":
+                    full_redraw = True
+                elif event.key == pygame.K_SPACE and engine.state == "narrative":
                     typewriter.complete()
 
                 # Handle numeric choices (1-9)
-                if game_state == "choice":
-                    choice_index = -1
-                    if pygame.K_1 <= event.key <= pygame.K_9:
-                        choice_index = event.key - pygame.K_1
-
-                    current_choices = choices_tree.get(current_node_key, {}).get("choices", [])
-                    if 0 <= choice_index < len(current_choices):
-                        # Determine the next node key
-                        if current_node_key == "start":
-                            next_key = str(choice_index + 1)
-                        else:
-                            next_key = f"{current_node_key}_{choice_index + 1}"
-                        
-                        # Find and process the next node
-                        if next_key in choices_tree:
-                            target_node = choices_tree[next_key]
-                            
-                            # Handle redirects
-                            if "redirect" in target_node:
-                                current_node_key = target_node["redirect"]
-                            else:
-                                current_node_key = next_key
-                            
-                            # Set new text and state
-                            new_text = choices_tree[current_node_key].get("text", "The story ends here.")
-                            typewriter.set_text(new_text)
-                            
-                            if choices_tree[current_node_key].get("choices"):
-                                game_state = "narrative"
-                            else:
-                                game_state = "ending"
-                        else:
-                            # If key doesn't exist, it's an unwritten ending
-                            typewriter.set_text("This path has not been written yet. The story ends here.")
-                            game_state = "ending"
+                if engine.state == "choice" and pygame.K_1 <= event.key <= pygame.K_9:
+                    transition_start = tracer.now()
+                    if engine.choose(event.key - pygame.K_1):
+                        text = engine.get_text()
+                        typewriter.set_text(text, prefetcher.take(text))
+                        typewriter.audio.set_node(engine.get_node_name())
+                        tracer.span("transition", transition_start, {"node": engine.get_node_name()})
+
+        tracer.mark("events")
+        hud.start_frame()
 
         # --- Game Logic / State Transitions ---
+        if audio_starter is not None and first_frame_ms is not None and audio_starter.is_done():
+            if audio_starter.clicks is not None:
+                typewriter.set_clicks(audio_starter.clicks)
+            elif audio_starter.sound is not None:
+                typewriter.set_sound(audio_starter.sound)
+            if audio_starter.error is not None:
+                print(f"Warning: {audio_starter.error}")
+            audio_starter = None
+
         typewriter.update()
         
-        if game_state == "narrative" and typewriter.is_finished():
-            game_state = "choice"
+        if engine.state == "narrative" and typewriter.is_finished():
+            engine.finish_narrative()
+            prefetcher.start(engine.get_next_texts())
+        hud.mark("update")
+        tracer.mark("update")
 
         # --- Drawing ---
+        if (engine.state, engine.node) != drawn_scene:
+            full_redraw = True
+
+        if USE_DIRTY_RECTS and not full_redraw:
+            # Only the typewriter animates; redraw just the areas it changed
+            dirty_rects = typewriter.get_dirty_rects()
+            for rect in dirty_rects:
+                screen.set_clip(rect)
+                screen.fill(BLACK)
+                typewriter.draw(screen)
+            screen.set_clip(None)
+            hud.mark("draw")
+            tracer.mark("draw")
+            if hud.visible and (hud.changed or hud.rect.collidelist(dirty_rects) != -1):
+                dirty_rects.append(hud.draw(screen))
+            hud.mark("hud")
+            tracer.mark("hud")
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
+            hud.mark("flip")
+            tracer.mark("flip")
+            hud.end_frame()
+            clock.tick(60)
+            tracer.mark("tick")
+            tracer.end_frame()
+            continue
+
+        full_redraw = False
+        drawn_scene = (engine.state, engine.node)
+        typewriter.get_dirty_rects()  # The whole screen is drawn, so reset its tracking
         screen.fill(BLACK)
         typewriter.draw(screen)
+        hud.mark("draw")
+        tracer.mark("draw")
 
         # Draw choices when available
-        if game_state == "choice":
-            choices = choices_tree.get(current_node_key, {}).get("choices", [])
+        if engine.state == "choice":
+            choices = engine.get_choices()
             if choices:
                 header = small_font.render("What will you do?", True, GOLD)
                 screen.blit(header, (20, text_area_rect.bottom + 20))
@@ -408,7 +665,7 @@ def main():
                     screen.blit(rendered, (40, text_area_rect.bottom + 50 + i * 30))
 
         # Draw ending message
-        if game_state == "ending":
+        if engine.state == "ending":
             ending_message = "The story has ended. Press F1 or ESC to exit."
             ending_surface = small_font.render(ending_message, True, GREY)
             screen.blit(ending_surface, (WIDTH // 2 - ending_surface.get_width() // 2, HEIGHT - 100))
@@ -417,9 +674,46 @@ def main():
         instruction_text = "SPACE to skip | F4 for fullscreen | F1/ESC to exit"
         instruction_surface = small_font.render(instruction_text, True, GREY)
         screen.blit(instruction_surface, (20, HEIGHT - 40))
+        hud.mark("choices")
+        tracer.mark("choices")
+
+        if hud.visible:
+            hud.draw(screen)
+        hud.mark("hud")
+        tracer.mark("hud")
 
         pygame.display.flip()
+        hud.mark("flip")
+        tracer.mark("flip")
+        hud.end_frame()
+        if first_frame_ms is None:
+            profile.step("first frame")
+            first_frame_ms = (profile.last - profile.start) * 1000
+            # Started only now so it doesn't compete with the first frame for the GIL
+            audio_starter = AudioStarter(TYPING_SOUND)
+            if args.profile_startup:
+                # The mixer and sound are started in the background meanwhile
+                running = False
+                if audio_starter.wait(10) and audio_starter.mixer_seconds is not None:
+                    profile.add("mixer init", audio_starter.mixer_seconds)
+                    profile.add("typing sound", audio_starter.sound_seconds)
+                profile.report()
+                if audio_starter.report is not None:
+                    print(audio_starter.report)
         clock.tick(60)
+        tracer.mark("tick")
+        tracer.end_frame()
+
+    if audio_starter is not None:
+        audio_starter.wait(1)  # Don't shut pygame down under the starter thread
+
+    if tracer.enabled:
+        tracer.metadata["typing sound mixer calls per node"] = typewriter.audio.get_mixer_calls()
+        try:
+            tracer.save(args.trace)
+            print(f"Saved a trace of the last {len(tracer.spans)} spans to '{args.trace}'")
+        except OSError as e:
+            print(f"Warning: Could not save the trace. {e}")
 
     pygame.quit()
     sys.exit()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+A small markup language for styling story text.
+
+Tags:
+    [red] [green] [gold] [grey] [white]   Named colors, closed with [/red] etc.
+    [color=#rrggbb]...[/color]            Any color
+    [b]...[/b]                            Bold
+    [i]...[/i]                            Italic
+    [u]...[/u]                            Underline
+    [[                                    A literal "["
+
+Tags can be nested. Text that looks like a tag but isn't one, and closing
+tags that don't match an open tag, are kept as ordinary text.
+
+The markup is parsed once into plain text plus style runs, so drawing a line
+only has to look up the runs that overlap it, however many tags the story uses.
+"""
+
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+# The style of a run of text. `color` is an RGB tuple.
+TextStyle = namedtuple("TextStyle", "color bold italic underline")
+
+# Colors that can be used by name, matching the game's palette
+NAMED_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 255),
+    "gold": (255, 215, 0),
+    "grey": (150, 150, 150),
+    "white": (255, 255, 255),
+}
+
+TAG_PATTERN = re.compile(r"\[\[|\[(/?)([a-z]+)(?:=(#[0-9a-fA-F]{6}))?\]")
+
+
+# --- StyledText Class (Plain text with style runs) ---
+class StyledText:
+    """
+    Plain text together with the style of every character, stored as runs.
+    Run i covers the text from starts[i] up to starts[i + 1].
+    """
+    def __init__(self, text, starts, styles):
+        """
+        Initializes the StyledText object.
+
+        Args:
+            text (str): The plain text, with all markup removed.
+            starts (list): Offset where each run starts, in increasing order.
+            styles (list): The TextStyle of each run.
+        """
+        self.text = text
+        self.starts = starts
+        self.styles = styles
+
+    def runs(self, start, end):
+        """
+        Returns the (text, style) runs that make up text[start:end].
+
+        Args:
+            start (int): Offset of the first character.
+            end (int): Offset just past the last character.
+        """
+        runs = []
+        end = min(end, len(self.text))
+        index = max(0, bisect_right(self.starts, start) - 1)
+        while start < end:
+            run_end = self.starts[index + 1] if index + 1 < len(self.starts) else end
+            run_end = min(run_end, end)
+            if run_end > start:
+                runs.append((self.text[start:run_end], self.styles[index]))
+            start = run_end
+            index += 1
+        return runs
+
+
+def apply_tag(style, name, value):
+    """Returns `style` changed by an opening tag, or None if the tag is unknown."""
+    if name in NAMED_COLORS:
+        return style._replace(color=NAMED_COLORS[name])
+    if name == "color" and value:
+        return style._replace(color=tuple(int(value[i:i + 2], 16) for i in (1, 3, 5)))
+    if name == "b":
+        return style._replace(bold=True)
+    if name == "i":
+        return style._replace(italic=True)
+    if name == "u":
+        return style._replace(underline=True)
+    return None
+
+
+def parse_markup(source, color):
+    """
+    Parses marked-up text into a StyledText.
+
+    Args:
+        source (str): Text that may contain markup tags.
+        color (tuple): The RGB color of text outside any color tag.
+    """
+    base_style = TextStyle(color, False, False, False)
+    stack = []              # (tag name, style) of every open tag
+    pieces = []
+    starts = [0]
+    styles = [base_style]
+    length = 0
+    position = 0
+
+    def set_style(style):
+        if styles[-1] == style:
+            return
+        if starts[-1] == length:
+            # The previous run is empty, so replace it
+            starts.pop()
+            styles.pop()
+            if styles and styles[-1] == style:
+                return
+        starts.append(length)
+        styles.append(style)
+
+    for match in TAG_PATTERN.finditer(source):
+        pieces.append(source[position:match.start()])
+        length += match.start() - position
+        position = match.end()
+
+        closing, name, value = match.groups()
+        current = stack[-1][1] if stack else base_style
+        if match.group() == "[[":
+            pieces.append("[")
+            length += 1
+        elif closing:
+            names = [tag for tag, _style in stack]
+            if name in names:
+                # Close the tag along with any tags left open inside it
+                del stack[len(names) - 1 - names[::-1].index(name):]
+                set_style(stack[-1][1] if stack else base_style)
+            else:
+                pieces.append(match.group())
+                length += len(match.group())
+        else:
+            style = apply_tag(current, name, value)
+            if style is None:
+                pieces.append(match.group())
+                length += len(match.group())
+            else:
+                stack.append((name, style))
+                set_style(style)
+
+    pieces.append(source[position:])
+    return StyledText("".join(pieces), starts, styles)
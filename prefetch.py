@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Prepares the text of the next story nodes while the player is choosing.
+
+While the choices are on screen the game has nothing to do until a key is
+pressed. The Prefetcher uses that time to get the text behind every choice
+ready for the typewriter: the markup is parsed, the opening lines are laid
+out, and those lines are rendered into the shared line cache. When a choice
+is made, the typewriter is handed the prepared text, so its first frames
+don't have to wrap or render anything.
+
+The work is split into small steps and run in slices between frames, on the
+main thread, since pygame fonts can't be used from two threads at once.
+"""
+
+import time
+
+from markup import parse_markup
+from text_layout import TextLayout
+
+# Longest time spent preparing text in one idle frame, in milliseconds
+PREFETCH_SLICE_MS = 4
+
+
+# --- Prefetcher Class (Prepares the next nodes' text in idle time) ---
+class Prefetcher:
+    """
+    Prepares texts for a TypewriterText ahead of time, a step at a time.
+    Prepared texts are kept until the next call to start() or take().
+    """
+    def __init__(self, typewriter):
+        """
+        Initializes the Prefetcher object.
+
+        Args:
+            typewriter (TypewriterText): The typewriter the texts are for. Its
+                font, width, height, color and line cache are used.
+        """
+        self.typewriter = typewriter
+        self.queue = []        # Texts still to prepare
+        self.prepared = {}     # Text -> (StyledText, TextLayout)
+        self.current = None    # Steps of the text being prepared
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, texts):
+        """Forgets what was prepared before and starts preparing `texts`."""
+        self.prepared = {}
+        self.current = None
+        self.queue = []
+        for text in texts:
+            if text not in self.queue:
+                self.queue.append(text)
+        self.queue.reverse()   # Taken from the end, so the first choice is prepared first
+
+    def is_busy(self):
+        """Returns True if there are texts left to prepare."""
+        return self.current is not None or bool(self.queue)
+
+    def prepare_steps(self, text):
+        """
+        Prepares one text, yielding after each step: parsing the markup and
+        laying out the opening lines, then rendering each of those lines.
+        """
+        typewriter = self.typewriter
+        styled = parse_markup(text, typewriter.color)
+        layout = TextLayout(styled.text, typewriter.font, typewriter.max_width)
+        rows = max(1, typewriter.max_height // typewriter.font.get_linesize())
+        lines = layout.first_lines(rows)
+        yield
+        for start, end in lines:
+            typewriter.get_line_surface(styled.runs(start, end))
+            yield
+        self.prepared[text] = (styled, layout)
+
+    def work(self, budget_ms=PREFETCH_SLICE_MS):
+        """Runs preparation steps until there are none left or `budget_ms` has passed."""
+        deadline = time.perf_counter() + budget_ms / 1000
+        while self.is_busy():
+            if self.current is None:
+                self.current = self.prepare_steps(self.queue.pop())
+            if next(self.current, StopIteration) is StopIteration:
+                self.current = None
+            if time.perf_counter() >= deadline:
+                break
+
+    def take(self, text):
+        """
+        Returns the prepared (StyledText, TextLayout) for `text`, or None if
+        it wasn't prepared in time, and stops preparing the other texts.
+        """
+        prepared = self.prepared.get(text)
+        if prepared is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.start([])
+        return prepared
+
+    def stats(self):
+        """Returns the counters as a dictionary, like the other caches."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Plays the story over and over with random choices and reports what happens.
+
+Each playthrough starts at the beginning and picks choices at random, with
+equal chances or with --weights, until it reaches an ending or an unwritten
+branch. The report shows how often each ending is reached, how long the
+playthroughs are, and which nodes are visited most; those are the nodes
+whose text is most worth preparing ahead of time.
+
+Playthroughs are run in fixed-size batches on all CPU cores. Every batch
+has its own random seed made from --seed and the batch number, so the same
+seed gives the same report however many processes are used.
+
+Usage:
+    python simulate.py [story.json] [--playthroughs N] [--weights W1,W2,...]
+                       [--seed N] [--jobs N] [--top N] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from story import STORY_FILE, StoryEngine, StoryError, get_worker_story, open_compiled_story, start_story_worker
+
+# Playthroughs per batch. Batches are the unit of work handed to each process.
+BATCH_SIZE = 50000
+
+# Playthroughs longer than this many choices are cut off, since a story with
+# loops can be played forever
+MAX_CHOICES = 1000
+
+# Width of the bars in the path length histogram
+HISTOGRAM_WIDTH = 40
+
+
+# --- Simulation ---
+def play_batch(story, batch, count, seed, weights=None, max_choices=MAX_CHOICES):
+    """
+    Runs `count` random playthroughs.
+
+    Args:
+        story (Story or NodeStore): The story to play.
+        batch (int): The batch number, mixed into the random seed.
+        count (int): How many playthroughs to run.
+        seed (int): The seed of the whole simulation.
+        weights (list, optional): Relative chance of picking each choice,
+            by position; choices past the end of the list get weight 1.
+        max_choices (int): Cut playthroughs off after this many choices.
+
+    Returns:
+        dict: "outcomes" maps (node, choice) to how many playthroughs ended
+            there; choice is -1 for endings and the choice that led nowhere
+            for unwritten branches, and node is -1 for playthroughs that were
+            cut off. "lengths" maps choices made to playthroughs, and
+            "visits" counts the visits to each node.
+    """
+    rng = random.Random(seed * 1000003 + batch)
+    pick_random = rng.random
+    engine = StoryEngine(story, skip_narrative=True)
+    starts = story.choice_starts
+    visits = array('L', [0]) * story.node_count
+    outcomes = {}
+    lengths = {}
+    cumulative = {}   # Choice count -> running totals of the weights
+
+    for _ in range(count):
+        engine.restart()
+        choices_made = 0
+        pick = -1
+        while True:
+            node = engine.node
+            visits[node] += 1
+            if engine.state == "ending" or choices_made == max_choices:
+                break
+            choice_count = starts[node + 1] - starts[node]
+            if weights is None:
+                pick = int(pick_random() * choice_count)
+            else:
+                totals = cumulative.get(choice_count)
+                if totals is None:
+                    padded = (list(weights) + [1] * choice_count)[:choice_count]
+                    if not any(padded):
+                        padded = [1] * choice_count   # All weighted 0: pick evenly
+                    totals = cumulative[choice_count] = list(accumulate(padded))
+                pick = bisect_right(totals, pick_random() * totals[-1])
+            engine.choose(pick)
+            choices_made += 1
+            if engine.unwritten:
+                break
+
+        if engine.unwritten:
+            outcome = (engine.node, pick)
+        elif engine.state == "ending":
+            outcome = (engine.node, -1)
+        else:
+            outcome = (-1, -1)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        lengths[choices_made] = lengths.get(choices_made, 0) + 1
+    return {"outcomes": outcomes, "lengths": lengths, "visits": visits}
+
+
+def merge_results(total, result):
+    """Adds the results of one batch to the running totals."""
+    for key, count in result["outcomes"].items():
+        total["outcomes"][key] = total["outcomes"].get(key, 0) + count
+    for key, count in result["lengths"].items():
+        total["lengths"][key] = total["lengths"].get(key, 0) + count
+    visits = total["visits"]
+    for node, count in enumerate(result["visits"]):
+        if count:
+            visits[node] += count
+
+
+def _play_batch(task):
+    """Runs one batch of playthroughs in a worker process."""
+    return play_batch(get_worker_story(), *task)
+
+
+def simulate(story, playthroughs, seed=0, weights=None, jobs=1, max_choices=MAX_CHOICES,
+             source_path=STORY_FILE):
+    """
+    Runs `playthroughs` random playthroughs in batches of BATCH_SIZE, on
+    `jobs` processes, and returns their combined results (see play_batch).
+    """
+    tasks = []
+    for batch, first in enumerate(range(0, playthroughs, BATCH_SIZE)):
+        tasks.append((batch, min(BATCH_SIZE, playthroughs - first), seed, weights, max_choices))
+    total = {"outcomes": {}, "lengths": {}, "visits": array('L', [0]) * story.node_count}
+
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            merge_results(total, play_batch(story, *task))
+        return total
+    with ProcessPoolExecutor(min(jobs, len(tasks)), initializer=start_story_worker,
+                             initargs=(source_path,)) as pool:
+        for result in pool.map(_play_batch, tasks):
+            merge_results(total, result)
+    return total
+
+
+# --- Report ---
+def build_report(story, result, playthroughs, seconds, top=10):
+    """Turns the results of simulate into a dictionary for printing or saving."""
+    outcomes = sorted(result["outcomes"].items(), key=lambda item: (-item[1], item[0]))
+    visits = result["visits"]
+    hot_nodes = sorted((node for node in range(story.node_count) if visits[node]),
+                       key=lambda node: (-visits[node], node))[:top]
+    total_visits = sum(visits)
+
+    def describe(outcome):
+        node, choice = outcome
+        if node == -1:
+            return {"kind": "cut off", "node": None}
+        if choice == -1:
+            return {"kind": "ending", "node": story.key(node)}
+        return {"kind": "unwritten", "node": story.key(node), "choice": choice + 1}
+
+    return {
+        "playthroughs": playthroughs,
+        "seconds": seconds,
+        "playthroughs_per_second": playthroughs / seconds if seconds else 0.0,
+        "outcomes": [dict(describe(outcome), count=count, share=count / playthroughs)
+                     for outcome, count in outcomes[:top]],
+        "distinct_outcomes": len(outcomes),
+        "lengths": {length: result["lengths"][length] for length in sorted(result["lengths"])},
+        "hot_nodes": [{"node": story.key(node), "visits": visits[node],
+                       "share": visits[node] / total_visits} for node in hot_nodes],
+    }
+
+
+def print_report(report):
+    """Prints a report made by build_report."""
+    print(f"Playthroughs:  {report['playthroughs']:,} in {report['seconds']:.2f} s "
+          f"({report['playthroughs_per_second']:,.0f} per second)")
+    print(f"\nHow playthroughs end ({report['distinct_outcomes']} different ways):")
+    for outcome in report["outcomes"]:
+        if outcome["kind"] == "unwritten":
+            where = f"{outcome['node']} choice {outcome['choice']} (unwritten)"
+        elif outcome["kind"] == "ending":
+            where = f"{outcome['node']} (ending)"
+        else:
+            where = "cut off"
+        print(f"    {where:<36} {outcome['count']:>10,} {outcome['share']:>7.2%}")
+
+    print("\nChoices made per playthrough:")
+    most = max(report["lengths"].values(), default=1)
+    for length, count in report["lengths"].items():
+        bar = "#" * max(1, round(count / most * HISTOGRAM_WIDTH))
+        print(f"    {length:>4} {count:>10,} {bar}")
+
+    print("\nMost visited nodes:")
+    for node in report["hot_nodes"]:
+        print(f"    {node['node']:<36} {node['visits']:>10,} {node['share']:>7.2%}")
+
+
+def parse_weights(text):
+    """Parses --weights, a comma-separated list of non-negative numbers."""
+    try:
+        weights = [float(weight) for weight in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a list of numbers") from None
+    if any(weight < 0 for weight in weights) or not any(weights):
+        raise argparse.ArgumentTypeError("weights must be non-negative and not all zero")
+    return weights
+
+
+def main():
+    """Parses the command line, runs the simulation and prints the report."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("story", nargs="?", default=STORY_FILE, help="the story.json file to play")
+    parser.add_argument("--playthroughs", type=int, default=1000000, help="how many playthroughs to run")
+    parser.add_argument("--weights", type=parse_weights,
+                        help="relative chance of picking the 1st, 2nd, ... choice (default: equal)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--max-choices", type=int, default=MAX_CHOICES,
+                        help="cut playthroughs off after this many choices")
+    parser.add_argument("--top", type=int, default=10, help="how many endings and nodes to list")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        story = open_compiled_story(args.story)
+    except StoryError as e:
+        print(f"Error: {e}")
+        return 1
+
+    start = time.perf_counter()
+    result = simulate(story, args.playthroughs, args.seed, args.weights, args.jobs, args.max_choices,
+                      args.story)
+    report = build_report(story, result, args.playthroughs, time.perf_counter() - start, args.top)
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Measures where the game's startup time goes, for python main.py --profile-startup.
+
+The game marks each step of its setup with StartupProfile.step(); the time
+since the previous mark is charged to that step. Work done on background
+threads is added with add(), as it doesn't hold up the first frame. Import
+times are measured separately with Python's -X importtime option, in a fresh
+interpreter, so they are the same as on a real start.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+# Imported modules taking at least this long are listed in the report, in milliseconds
+SLOW_IMPORT_MS = 10
+
+
+def get_import_times(module="main"):
+    """
+    Imports `module` in a new Python process with -X importtime.
+
+    Returns:
+        list: (name, depth, milliseconds) of every module imported, with the
+            time including the modules it imported in turn. Depth 0 is
+            `module` itself. Empty if the times couldn't be measured.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, cwd=directory, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return []
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # The column headings
+        name = parts[2]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(parts[1]) / 1000))
+    # Only keep what `module` imported, not the modules Python imports to
+    # start up. Modules are listed after the ones they import, so that is
+    # everything after the previous top-level module, up to `module`.
+    for end, (name, depth, _ms) in enumerate(times):
+        if name == module and depth == 0:
+            start = end
+            while start > 0 and times[start - 1][1] > 0:
+                start -= 1
+            return times[start:end + 1]
+    return []
+
+
+# --- StartupProfile Class (Times each step of the game's setup) ---
+class StartupProfile:
+    """Records how long each step of startup takes and prints a report."""
+    def __init__(self, start=None):
+        """
+        Initializes the StartupProfile object.
+
+        Args:
+            start (float, optional): time.perf_counter() when startup began.
+                Defaults to now.
+        """
+        self.start = start if start is not None else time.perf_counter()
+        self.last = self.start
+        self.steps = []        # (name, seconds) of the steps up to the first frame
+        self.background = []   # (name, seconds) of the work done on other threads
+
+    def step(self, name):
+        """Charges the time since the last step to a step called `name`."""
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def add(self, name, seconds):
+        """Records work done on a background thread, which doesn't delay the first frame."""
+        self.background.append((name, seconds))
+
+    def report(self, module="main"):
+        """Prints the steps, the background work and the slowest imports."""
+        total = self.last - self.start
+        print(f"Startup: first frame after {total * 1000:.1f} ms")
+        for name, seconds in self.steps:
+            share = seconds / total if total else 0.0
+            print(f"    {name:<32} {seconds * 1000:8.1f} ms {share:6.1%}")
+        if self.background:
+            print("On background threads:")
+            for name, seconds in self.background:
+                print(f"    {name:<32} {seconds * 1000:8.1f} ms")
+
+        times = get_import_times(module)
+        if not times:
+            print("Could not measure the import times")
+            return
+        print(f"Imports (measured in a new process; {module} took {times[-1][2]:.1f} ms in all):")
+        for name, depth, ms in times:
+            if depth == 1:
+                print(f"    {name:<32} {ms:8.1f} ms")
+        slow = sorted((entry for entry in times if entry[1] > 1 and entry[2] >= SLOW_IMPORT_MS),
+                      key=lambda entry: -entry[2])
+        if slow:
+            print(f"  of which, imported by those (at least {SLOW_IMPORT_MS} ms):")
+            for name, _depth, ms in slow[:8]:
+                print(f"    {name:<32} {ms:8.1f} ms")
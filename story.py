@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+Loading of the game's story.
+
+The story is written in story.json (see the README for its format) and
+compiled into story.bin, a compact binary form that the game maps into
+memory (or loads with a single read). story.bin is rebuilt automatically
+whenever story.json is newer than it, so it never has to be made by hand.
+
+In the compiled form every node is a number and every piece of text lives
+once in a shared string table. Loading it only wraps the file's bytes in
+memoryviews; strings are decoded when they are first asked for. Startup
+therefore doesn't grow with the number of nodes the way building a dict of
+every node does.
+
+StoryEngine plays a story: it keeps track of where the player is and what
+they can do next. Like the rest of this module it doesn't use pygame, so
+stories can be compiled, checked, played and simulated without SDL.
+
+Compiled format (all integers are unsigned 32-bit little-endian):
+
+    Header      magic b"STRY", version, node count, choice count,
+                string count, size of the string data in bytes, start node
+    Strings     string count + 1 offsets into the string data
+    Node keys   string id of each node's key, nodes sorted by key
+    Node texts  string id of each node's text, or NO_STRING
+    Redirects   string id of the key each node redirects to, or NO_STRING
+    Choices     node count + 1 offsets into the choice labels; the choices
+                of node n are labels[choices[n]:choices[n + 1]]
+    Labels      string id of each choice's label
+    Targets     the node each choice leads to, or NO_NODE if it leads
+                nowhere (the path hasn't been written yet)
+    String data every string, UTF-8 encoded, one after the other
+
+Where each choice leads is worked out when the story is compiled: option n
+of node k leads to node "k_n" (from the start node, to "n"), and redirects
+are followed to the node they finally end at. Choosing is then a single
+lookup in the Targets table. Choices that lead nowhere, redirects to missing
+nodes and redirect loops are reported by compile_story.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+from atomic_file import atomic_path
+
+# Where the story is kept, next to this file
+STORY_DIR = os.path.dirname(os.path.abspath(__file__))
+STORY_FILE = os.path.join(STORY_DIR, "story.json")
+COMPILED_STORY_FILE = os.path.join(STORY_DIR, "story.bin")
+
+STORY_MAGIC = b"STRY"
+STORY_VERSION = 2
+HEADER = struct.Struct("<4s6I")
+
+# Text shown for a node without text, and for a path that isn't written yet
+MISSING_TEXT = "The story ends here."
+UNWRITTEN_TEXT = "This path has not been written yet. The story ends here."
+
+# Marks a missing text or redirect, or a choice that leads nowhere, in the
+# compiled tables
+NO_STRING = 0xFFFFFFFF
+NO_NODE = 0xFFFFFFFF
+
+
+class StoryError(Exception):
+    """Raised when a story file can't be read or compiled."""
+
+
+# --- Compiling ---
+def child_key(key, choice, start_key="start"):
+    """Returns the key of the node that option `choice` (from 0) of `key` leads to."""
+    if key == start_key:
+        return str(choice + 1)
+    return f"{key}_{choice + 1}"
+
+
+def resolve_redirects(keys, nodes, problems):
+    """
+    Returns the node each node finally leads to once its redirects are
+    followed, as an array of node numbers, NO_NODE for redirects that end
+    at a missing node or go round in a loop.
+    """
+    index = {key: i for i, key in enumerate(keys)}
+    resolved = array('I', [NO_NODE]) * len(keys)
+    done = bytearray(len(keys))
+    for first in range(len(keys)):
+        chain = []
+        node = first
+        while node != NO_NODE and not done[node]:
+            if node in chain:
+                problems.append(f"Redirect loop: {' -> '.join(keys[n] for n in chain)}")
+                node = NO_NODE
+                break
+            redirect = nodes[keys[node]].get("redirect")
+            if redirect is None:
+                resolved[node] = node
+                done[node] = 1
+                break
+            chain.append(node)
+            if redirect not in index:
+                problems.append(f"Node '{keys[node]}' redirects to missing node '{redirect}'")
+            node = index.get(redirect, NO_NODE)
+        target = NO_NODE if node == NO_NODE else resolved[node]
+        for node in chain:
+            resolved[node] = target
+            done[node] = 1
+    return index, resolved
+
+
+# --- NodeStore Class (A story held in parallel arrays) ---
+class NodeStore:
+    """
+    A story held in memory as parallel arrays indexed by node number, the
+    form a story is compiled from and the one it's saved in.
+
+    Node n's key, text and redirect are string ids in keys[n], texts[n] and
+    redirects[n]; its choices are the entries choice_starts[n] up to
+    choice_starts[n + 1] of the flat `labels` and `targets` arrays, so a
+    node's children are a range of one array('I') rather than a list per
+    node. Each string is stored once, in `strings`. Nodes are numbered in
+    the order of their keys.
+    """
+    def __init__(self):
+        """Initializes an empty NodeStore object."""
+        self.strings = []
+        self.string_ids = {}
+        self.keys = array('I')
+        self.texts = array('I')
+        self.redirects = array('I')
+        self.choice_starts = array('I', [0])
+        self.labels = array('I')
+        self.targets = array('I')
+        self.node_count = 0
+        self.start = 0
+
+    @staticmethod
+    def from_source(source, problems=None):
+        """
+        Builds a NodeStore from a story, working out where every choice leads.
+
+        Args:
+            source (dict): The parsed contents of a story.json file.
+            problems (list, optional): Receives a message for every choice that
+                leads nowhere, redirect to a missing node and redirect loop.
+        """
+        if problems is None:
+            problems = []
+        nodes = source.get("nodes")
+        if not isinstance(nodes, dict) or not nodes:
+            raise StoryError("The story has no nodes")
+        start_key = source.get("start", "start")
+        if start_key not in nodes:
+            raise StoryError(f"The start node '{start_key}' doesn't exist")
+
+        store = NodeStore()
+        keys = sorted(nodes, key=lambda key: key.encode("utf-8"))
+        for key in keys:
+            node = nodes[key]
+            if not isinstance(node, dict):
+                raise StoryError(f"Node '{key}' is not an object")
+            text, redirect, labels = node.get("text"), node.get("redirect"), node.get("choices", [])
+            if text is not None and not isinstance(text, str):
+                raise StoryError(f"The text of node '{key}' is not a string")
+            if redirect is not None and not isinstance(redirect, str):
+                raise StoryError(f"The redirect of node '{key}' is not a string")
+            if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+                raise StoryError(f"The choices of node '{key}' are not a list of strings")
+            store.add_node(key, text, redirect, labels)
+        store.start = keys.index(start_key)
+
+        # Work out where every choice finally leads
+        index, resolved = resolve_redirects(keys, nodes, problems)
+        for node, key in enumerate(keys):
+            for choice in range(store.choice_count(node)):
+                child = child_key(key, choice, start_key)
+                target = index.get(child)
+                if target is None:
+                    problems.append(f"Choice {choice + 1} of node '{key}' leads to missing node '{child}'")
+                    store.targets.append(NO_NODE)
+                else:
+                    store.targets.append(resolved[target])
+        return store
+
+    def intern(self, text):
+        """Returns the id of a string, adding it to the string table if it's new."""
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def add_node(self, key, text, redirect, labels):
+        """
+        Adds a node and returns its number. Nodes must be added in the order
+        of their keys, and where their choices lead is added to `targets`
+        separately, in the same order.
+        """
+        self.keys.append(self.intern(key))
+        self.texts.append(NO_STRING if text is None else self.intern(text))
+        self.redirects.append(NO_STRING if redirect is None else self.intern(redirect))
+        self.labels.extend(map(self.intern, labels))
+        self.choice_starts.append(len(self.labels))
+        self.node_count += 1
+        return self.node_count - 1
+
+    def choice_count(self, node):
+        """Returns how many choices a node has."""
+        return self.choice_starts[node + 1] - self.choice_starts[node]
+
+    def to_bytes(self):
+        """Returns the store in the compiled format described above."""
+        strings = [text.encode("utf-8") for text in self.strings]
+        offsets = array('I', [0])
+        offsets.extend(accumulate(map(len, strings)))
+
+        tables = [offsets, self.keys, self.texts, self.redirects, self.choice_starts, self.labels, self.targets]
+        if sys.byteorder == "big":
+            tables = [array('I', table) for table in tables]
+            for table in tables:
+                table.byteswap()
+        header = HEADER.pack(STORY_MAGIC, STORY_VERSION, len(self.keys), len(self.labels), len(strings),
+                             offsets[-1], self.start)
+        return b"".join([header, *(table.tobytes() for table in tables), *strings])
+
+
+def compile_story(source, problems=None):
+    """
+    Compiles a story into the binary format described above.
+
+    Args:
+        source (dict): The parsed contents of a story.json file.
+        problems (list, optional): Receives a message for every choice that
+            leads nowhere, redirect to a missing node and redirect loop.
+
+    Returns:
+        bytes: The compiled story.
+    """
+    return NodeStore.from_source(source, problems).to_bytes()
+
+
+def compile_story_file(source_path=STORY_FILE, compiled_path=COMPILED_STORY_FILE, problems=None):
+    """
+    Compiles a story.json file and writes the result to `compiled_path`.
+    Returns the compiled bytes. `problems` is passed on to compile_story.
+    """
+    try:
+        with open(source_path, encoding="utf-8") as source_file:
+            source = json.load(source_file)
+    except (OSError, ValueError) as e:
+        raise StoryError(f"Could not read '{source_path}': {e}") from e
+    data = compile_story(source, problems)
+
+    try:
+        with atomic_path(compiled_path) as temp_path, open(temp_path, "wb") as compiled_file:
+            compiled_file.write(data)
+    except OSError as e:
+        print(f"Warning: Could not save the compiled story to '{compiled_path}'. Error: {e}")
+    return data
+
+
+def is_stale(source_path, compiled_path):
+    """Returns True if the compiled story is missing or older than its source."""
+    try:
+        return os.path.getmtime(compiled_path) < os.path.getmtime(source_path)
+    except OSError:
+        return True
+
+
+# --- Story Class (A compiled story) ---
+class Story:
+    """
+    A compiled story. Nodes are numbered 0 to node_count - 1 in the order of
+    their keys, and `start` is the node the story begins at. Texts and
+    labels are decoded from the string table on use.
+    """
+    def __init__(self, data):
+        """
+        Initializes the Story object.
+
+        Args:
+            data (bytes or mmap.mmap): A compiled story, as made by compile_story.
+        """
+        if len(data) < HEADER.size:
+            raise StoryError("The compiled story is truncated")
+        (magic, version, node_count, choice_count,
+         string_count, string_bytes, start) = HEADER.unpack_from(data)
+        if magic != STORY_MAGIC or version != STORY_VERSION:
+            raise StoryError("The compiled story has an unknown format")
+        self.data = data
+        self.node_count = node_count
+        self.start = start
+
+        sizes = (string_count + 1, node_count, node_count, node_count, node_count + 1,
+                 choice_count, choice_count)
+        if len(data) != HEADER.size + 4 * sum(sizes) + string_bytes:
+            raise StoryError("The compiled story is truncated")
+        view = memoryview(data)
+        position = HEADER.size
+        tables = []
+        for size in sizes:
+            table = view[position:position + 4 * size]
+            if sys.byteorder == "big":
+                table = array('I', table)
+                table.byteswap()
+            else:
+                table = table.cast('I')
+            tables.append(table)
+            position += 4 * size
+        (self.offsets, self.keys, self.texts, self.redirects, self.choice_starts, self.labels,
+         self.targets) = tables
+        self.string_start = position
+
+    def string(self, string_id):
+        """Returns a string from the string table."""
+        start = self.string_start + self.offsets[string_id]
+        end = self.string_start + self.offsets[string_id + 1]
+        return str(self.data[start:end], "utf-8")
+
+    def key(self, node):
+        """Returns the key of a node."""
+        return self.string(self.keys[node])
+
+    def text(self, node, default=None):
+        """Returns a node's text, or `default` if it has none."""
+        string_id = self.texts[node]
+        return default if string_id == NO_STRING else self.string(string_id)
+
+    def choices(self, node):
+        """Returns the labels of a node's choices."""
+        return [self.string(self.labels[i]) for i in range(self.choice_starts[node], self.choice_starts[node + 1])]
+
+
+def load_story(source_path=STORY_FILE, compiled_path=COMPILED_STORY_FILE, use_mmap=True):
+    """
+    Loads the compiled story, compiling it first if it's missing or older
+    than its source.
+
+    Args:
+        source_path (str): The story.json file.
+        compiled_path (str): The story.bin file.
+        use_mmap (bool): Map the compiled file into memory instead of
+            reading it, so only the parts that are used are paged in and
+            loading takes the same time however big the story is.
+    """
+    has_source = os.path.exists(source_path)
+    if not has_source or not is_stale(source_path, compiled_path):
+        try:
+            with open(compiled_path, "rb") as compiled_file:
+                if use_mmap:
+                    return Story(mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ))
+                return Story(compiled_file.read())
+        except (OSError, ValueError, StoryError) as e:
+            if not has_source:
+                raise StoryError(f"Could not read '{compiled_path}': {e}") from e
+            # Made by another version of the game, so compile it again
+    return Story(compile_story_file(source_path, compiled_path))
+
+
+def get_compiled_path(source_path):
+    """
+    Returns where the compiled form of a story.json file is kept: story.bin
+    for the game's own story, otherwise the same name ending in .bin.
+    """
+    if os.path.abspath(source_path) == STORY_FILE:
+        return COMPILED_STORY_FILE
+    return os.path.splitext(source_path)[0] + ".bin"
+
+
+def open_compiled_story(source_path=STORY_FILE):
+    """Loads a story.json file through its compiled form, see get_compiled_path."""
+    return load_story(source_path, get_compiled_path(source_path))
+
+
+# --- Worker Processes ---
+# The tools that spread their work over processes open the story once in
+# each worker: start_story_worker is the pool's initializer and the tasks
+# get the story with get_worker_story. Only the story's path is sent to
+# the workers, and the compiled file is shared between them through mmap.
+_worker_story = None
+
+
+def start_story_worker(source_path):
+    """Opens the story in a worker process. Use it as a process pool's initializer."""
+    global _worker_story
+    _worker_story = open_compiled_story(source_path)
+
+
+def get_worker_story():
+    """Returns the story opened by start_story_worker in this process."""
+    return _worker_story
+
+
+# --- StoryEngine Class (Plays a story) ---
+class StoryEngine:
+    """
+    Plays a story one choice at a time, without any display.
+
+    The engine is always in one of three states:
+        "narrative"  The current node's text is being shown.
+        "choice"     The text has been shown; waiting for a choice.
+        "ending"     The story is over: the node has no choices, or the
+                     last choice led to a path that hasn't been written yet.
+
+    A front end shows get_text(), calls finish_narrative() once the text has
+    been shown, and passes the player's choices to choose().
+    """
+    def __init__(self, story, skip_narrative=False):
+        """
+        Initializes the StoryEngine object at the start of the story.
+
+        Args:
+            story (Story or NodeStore): The story to play.
+            skip_narrative (bool): Go straight to "choice" on reaching a node,
+                for simulations that don't show any text.
+        """
+        self.story = story
+        self.skip_narrative = skip_narrative
+        self.restart()
+
+    def restart(self):
+        """Goes back to the start of the story."""
+        self._enter(self.story.start)
+
+    def _enter(self, node):
+        """Moves to a node and sets the state for it."""
+        self.node = node
+        self.unwritten = False
+        starts = self.story.choice_starts
+        if starts[node + 1] == starts[node]:
+            self.state = "ending"
+        elif self.skip_narrative:
+            self.state = "choice"
+        else:
+            self.state = "narrative"
+
+    def finish_narrative(self):
+        """Called once the current text has been shown; moves on to the choices."""
+        if self.state == "narrative":
+            self.state = "choice"
+
+    def choose(self, choice):
+        """
+        Makes a choice. Returns True if it was made, or False if there is no
+        such choice or the engine isn't waiting for one.
+
+        Args:
+            choice (int): The index of the choice, from 0.
+        """
+        if self.state != "choice":
+            return False
+        starts = self.story.choice_starts
+        first = starts[self.node]
+        if not 0 <= choice < starts[self.node + 1] - first:
+            return False
+        target = self.story.targets[first + choice]
+        if target == NO_NODE:
+            # The path hasn't been written yet, so the story ends here
+            self.unwritten = True
+            self.state = "ending"
+        else:
+            self._enter(target)
+        return True
+
+    def get_text(self):
+        """Returns the text to show for where the player is."""
+        if self.unwritten:
+            return UNWRITTEN_TEXT
+        return self.story.text(self.node, MISSING_TEXT)
+
+    def get_choices(self):
+        """Returns the labels of the choices on offer, if the engine is waiting for one."""
+        if self.state != "choice":
+            return []
+        return self.story.choices(self.node)
+
+    def get_next_texts(self):
+        """
+        Returns the text each choice on offer would lead to, in order,
+        without making it. Empty if the engine isn't waiting for a choice.
+        """
+        if self.state != "choice":
+            return []
+        starts = self.story.choice_starts
+        targets = self.story.targets
+        texts = []
+        for edge in range(starts[self.node], starts[self.node + 1]):
+            target = targets[edge]
+            if target == NO_NODE:
+                texts.append(UNWRITTEN_TEXT)
+            else:
+                texts.append(self.story.text(target, MISSING_TEXT))
+        return texts
+
+    def get_node_name(self):
+        """Returns the current node's key, marked if the player is on an unwritten path."""
+        key = self.story.key(self.node)
+        return f"{key} (unwritten)" if self.unwritten else key
+
+
+if __name__ == "__main__":
+    # Compile the story ahead of time: python story.py [story.json [story.bin]]
+    source_path = sys.argv[1] if len(sys.argv) > 1 else STORY_FILE
+    compiled_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source_path)[0] + ".bin"
+    problems = []
+    try:
+        compiled = Story(compile_story_file(source_path, compiled_path, problems))
+    except StoryError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for problem in problems:
+        print(f"Warning: {problem}")
+    print(f"Compiled {compiled.node_count} nodes into '{compiled_path}' ({len(compiled.data)} bytes)")
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Text layout helpers used by the typewriter effect.
+
+The typewriter reveals its text one character at a time, so the text that has
+to be word-wrapped grows by a character every few frames. Re-wrapping the whole
+revealed prefix every frame gets slower the longer the passage is; the helpers
+in this module keep the work per frame small.
+"""
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from operator import add
+
+
+# --- IncrementalWrapper Class (Word-wraps a growing prefix) ---
+class IncrementalWrapper:
+    """
+    Word-wraps a growing prefix of a text, reusing the lines laid out so far.
+
+    The output for any prefix is exactly what TypewriterText.wrap_text returns
+    for that prefix. Lines of finished paragraphs and words that are already
+    followed by a space are laid out once and kept; each call only measures
+    the word that is still being typed.
+    """
+    def __init__(self, font, max_width, text=""):
+        """
+        Initializes the IncrementalWrapper object.
+
+        Args:
+            font (pygame.font.Font): The font used to measure text.
+            max_width (int): The maximum width for a line of text before wrapping.
+            text (str): The full text whose prefixes will be wrapped.
+        """
+        self.font = font
+        self.max_width = max_width
+        self.reset(text)
+
+    def reset(self, text):
+        """Discards all cached lines and starts over with new text."""
+        self.text = text
+        self._lines = []           # Lines of finished paragraphs
+        self._para_start = 0       # Offset where the current paragraph starts
+        self._para_lines = []      # Finished lines of the current paragraph
+        self._current_line = ""    # Line being built from the committed words
+        self._word_start = 0       # Offset of the first uncommitted word
+        self._scanned = 0          # Offset up to which the text has been scanned
+        self._cached_length = -1
+        self._cached_lines = []
+        self._starts = []          # Offsets of the finished lines found so far
+        self._search_start = 0     # Where to look for the next finished line
+
+    def _fit_word(self, current_line, word, para_lines):
+        """Adds a word to the line the same way wrap_text does."""
+        test_line = f"{current_line} {word}".strip()
+        if self.font.size(test_line)[0] <= self.max_width:
+            return test_line
+        para_lines.append(current_line)
+        return word
+
+    def _advance(self, length):
+        """Commits every word and paragraph that ends before `length`."""
+        text = self.text
+        for i in range(self._scanned, length):
+            char = text[i]
+            if char == ' ':
+                word = text[self._word_start:i]
+                self._current_line = self._fit_word(self._current_line, word, self._para_lines)
+                self._word_start = i + 1
+            elif char == '\n':
+                paragraph = text[self._para_start:i]
+                if not paragraph.strip():
+                    self._lines.append("")
+                else:
+                    word = text[self._word_start:i]
+                    current_line = self._fit_word(self._current_line, word, self._para_lines)
+                    self._lines.extend(self._para_lines)
+                    self._lines.append(current_line)
+                self._para_start = i + 1
+                self._para_lines = []
+                self._current_line = ""
+                self._word_start = i + 1
+        self._scanned = length
+
+    def wrap(self, length):
+        """
+        Returns the wrapped lines for the first `length` characters of the text.
+
+        Args:
+            length (int): The number of characters of the text to wrap.
+        """
+        if length == self._cached_length:
+            return self._cached_lines
+        if length < self._scanned:
+            # The prefix shrank, so the committed lines may no longer apply
+            self.reset(self.text)
+        self._advance(length)
+
+        lines = self._lines.copy()
+        if not self.text[self._para_start:length].strip():
+            lines.append("")
+        else:
+            word = self.text[self._word_start:length]
+            para_lines = self._para_lines.copy()
+            current_line = self._fit_word(self._current_line, word, para_lines)
+            lines.extend(para_lines)
+            lines.append(current_line)
+
+        self._cached_length = length
+        self._cached_lines = lines
+        return lines
+
+    def _locate(self, line, position):
+        """
+        Finds where a wrapped line starts, looking right after `position`.
+        Returns (start, end), or (None, position) if the line doesn't appear
+        there because wrap_text collapsed some spaces in it.
+        """
+        if not line:
+            return position, position
+        text = self.text
+        while position < len(text) and text[position] in " \n":
+            position += 1
+        if text.startswith(line, position):
+            return position, position + len(line)
+        return None, position
+
+    def line_starts(self, length):
+        """
+        Returns the offset in the text where each line of wrap(length) starts,
+        so the lines can be matched up with the styles of the text. A line
+        gets None if it can't be matched because wrap_text collapsed spaces.
+
+        Args:
+            length (int): The number of characters of the text to wrap.
+        """
+        lines = self.wrap(length)
+        finished = len(self._lines) + len(self._para_lines)
+        while len(self._starts) < finished:
+            start, self._search_start = self._locate(lines[len(self._starts)], self._search_start)
+            self._starts.append(start)
+
+        starts = self._starts.copy()
+        position = self._search_start
+        for line in lines[len(starts):]:
+            start, position = self._locate(line, position)
+            starts.append(start)
+        return starts
+
+
+# --- WidthTable Class (Prefix sums of character widths) ---
+class WidthTable:
+    """
+    Estimates the width of any slice of a string in constant time.
+
+    Every character's advance (from font.metrics) plus a kerning correction
+    for the pair it forms with the previous character is added up once into a
+    prefix-sum array. The width of text[start:end] is then a subtraction.
+    SDL_ttf positions glyphs with sub-pixel precision, so the estimate can be
+    a few pixels off font.size; callers that need exact widths use it to narrow
+    down the candidates and confirm the final answer with font.size.
+    """
+    # Advances and kerning corrections are shared by every table of a font
+    _advances = {}
+    _kerning = {}
+
+    def __init__(self, font, text):
+        """
+        Initializes the WidthTable object.
+
+        Args:
+            font (pygame.font.Font): The font used to measure text.
+            text (str): The text to measure.
+        """
+        self.font = font
+        self.text = text
+        advances = self._advances.setdefault(font, {})
+        kerning = self._kerning.setdefault(font, {})
+
+        # Measure each distinct character and pair once, then look them up
+        for char in set(text) - advances.keys():
+            metrics = font.metrics(char)
+            if metrics and metrics[0] is not None:
+                advances[char] = metrics[0][4]
+            else:
+                advances[char] = font.size(char)[0]
+        pairs = list(map(add, text, text[1:]))
+        for pair in set(pairs) - kerning.keys():
+            kerning[pair] = (font.size(pair)[0]
+                             - font.size(pair[0])[0] - font.size(pair[1])[0])
+
+        # kerning[i] is the correction between text[i - 1] and text[i]
+        self.kerning = array('l', [0])
+        self.kerning.extend(map(kerning.__getitem__, pairs))
+        self.kerning.append(0)
+        steps = map(add, map(advances.__getitem__, text), self.kerning)
+        self.prefix = array('l', [0])
+        self.prefix.extend(accumulate(steps))
+
+    def width(self, start, end):
+        """Returns the estimated width of text[start:end]."""
+        if end <= start:
+            return 0
+        return self.prefix[end] - self.prefix[start] - self.kerning[start]
+
+
+# --- Line Breaking ---
+def break_paragraph(text, font, max_width, para_start, para_end):
+    """
+    Yields the (start, end) offsets of each line of the paragraph
+    text[para_start:para_end], one line at a time.
+
+    Lines are broken at spaces, each holding as many words as fit in
+    max_width, and a blank paragraph becomes one empty line. The last word
+    of each line is found with a binary search over the word boundaries
+    using a WidthTable, then confirmed with font.size, so a line costs a
+    handful of measurements instead of one per word.
+
+    The lines are the ones TypewriterText.wrap_text makes, except in two
+    cases (IncrementalWrapper matches wrap_text in both):
+    - Runs of spaces inside a line are kept as they are, since the lines are
+      slices of the text, and are measured that way; wrap_text collapses
+      them to one space, so it can fit more words on the line.
+    - A first word too wide for the line starts the paragraph; wrap_text
+      puts an empty line before it.
+
+    Args:
+        text (str): The text the paragraph is part of.
+        font (pygame.font.Font): The font used to measure text.
+        max_width (int): The maximum width for a line of text before wrapping.
+        para_start (int): Offset where the paragraph starts.
+        para_end (int): Offset where the paragraph ends (its newline, if any).
+    """
+    paragraph = text[para_start:para_end]
+    widths = WidthTable(font, paragraph)
+
+    # Offsets of the words that can start a line, relative to the paragraph
+    word_starts = []
+    word_ends = []
+    word_start = 0
+    for word in paragraph.split(' '):
+        if word.strip():
+            word_starts.append(word_start)
+            word_ends.append(word_start + len(word))
+        word_start += len(word) + 1
+
+    if not word_starts:
+        yield (para_start, para_start)
+    first = 0
+    while first < len(word_starts):
+        line_start = word_starts[first]
+
+        # Binary search for the last word whose estimated line width fits
+        low, high = first, len(word_starts) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if widths.width(line_start, word_ends[middle]) <= max_width:
+                low = middle
+            else:
+                high = middle - 1
+        last = low
+
+        # The estimate may be off by a few pixels, so settle it with font.size
+        while last > first and font.size(paragraph[line_start:word_ends[last]])[0] > max_width:
+            last -= 1
+        while (last + 1 < len(word_starts)
+               and font.size(paragraph[line_start:word_ends[last + 1]])[0] <= max_width):
+            last += 1
+
+        yield (para_start + line_start, para_start + word_ends[last])
+        first = last + 1
+
+
+def layout_text(text, font, max_width):
+    """
+    Word-wraps the whole text at once and returns where each line starts and
+    ends, as (start, end) offsets into `text`.
+
+    Args:
+        text (str): The text to lay out.
+        font (pygame.font.Font): The font used to measure text.
+        max_width (int): The maximum width for a line of text before wrapping.
+    """
+    lines = []
+    para_start = 0
+    for paragraph in text.split('\n'):
+        para_end = para_start + len(paragraph)
+        lines.extend(break_paragraph(text, font, max_width, para_start, para_end))
+        para_start = para_end + 1
+    return lines
+
+
+# --- TextLayout Class (Lays out only what is on screen) ---
+class TextLayout:
+    """
+    Word-wraps a text lazily, one paragraph at a time, so that showing the
+    lines around the cursor only lays out the paragraphs those lines belong
+    to. Lines that have been laid out are kept as (start, end) offsets in an
+    array per paragraph, which is all that is retained once they scroll away.
+    """
+    def __init__(self, text, font, max_width):
+        """
+        Initializes the TextLayout object.
+
+        Args:
+            text (str): The text to lay out.
+            font (pygame.font.Font): The font used to measure text.
+            max_width (int): The maximum width for a line of text before wrapping.
+        """
+        self.text = text
+        self.font = font
+        self.max_width = max_width
+
+        self.para_starts = array('I', [0])
+        newline = text.find('\n')
+        while newline != -1:
+            self.para_starts.append(newline + 1)
+            newline = text.find('\n', newline + 1)
+
+        self._lines = {}      # Paragraph -> array of line starts and ends, interleaved
+        self._breakers = {}   # Paragraph -> line generator, while not fully laid out
+
+    def paragraph_lines(self, paragraph, until=None):
+        """
+        Returns the lines of a paragraph laid out so far, as an array of
+        interleaved start and end offsets. Lays out the whole paragraph, or
+        with `until` only as far as the first line starting after that offset.
+        """
+        lines = self._lines.get(paragraph)
+        if lines is None:
+            para_start = self.para_starts[paragraph]
+            if paragraph + 1 < len(self.para_starts):
+                para_end = self.para_starts[paragraph + 1] - 1
+            else:
+                para_end = len(self.text)
+            lines = self._lines[paragraph] = array('I')
+            self._breakers[paragraph] = break_paragraph(self.text, self.font, self.max_width,
+                                                        para_start, para_end)
+
+        breaker = self._breakers.get(paragraph)
+        while breaker is not None and (until is None or not lines or lines[-2] <= until):
+            line = next(breaker, None)
+            if line is None:
+                del self._breakers[paragraph]
+                break
+            lines.extend(line)
+        return lines
+
+    def first_lines(self, count):
+        """
+        Returns the first `count` lines of the text as (start, end) pairs,
+        laying out no further than needed.
+        """
+        first = []
+        for paragraph in range(len(self.para_starts)):
+            lines = self.paragraph_lines(paragraph, self.para_starts[paragraph])
+            while len(lines) // 2 < count - len(first):
+                laid_out = len(lines)
+                lines = self.paragraph_lines(paragraph, lines[-2])
+                if len(lines) == laid_out:
+                    break  # The whole paragraph is laid out
+            needed = min(len(lines) // 2, count - len(first))
+            first.extend((lines[2 * i], lines[2 * i + 1]) for i in range(needed))
+            if len(first) == count:
+                break
+        return first
+
+    def window(self, index, rows):
+        """
+        Returns the lines that end the text revealed up to `index`: at most
+        `rows` (start, end) pairs, the last one being the line `index` is on.
+        Also returns True if the first of them is the first line of the text.
+        """
+        paragraph = bisect_right(self.para_starts, index) - 1
+        lines = self.paragraph_lines(paragraph, index)
+        # The paragraph may be laid out well past `index` (e.g. by first_lines),
+        # so keep only the lines that start at or before it
+        count = max(1, bisect_right(lines[0::2], index))
+
+        window = [(lines[2 * i], lines[2 * i + 1]) for i in range(max(0, count - rows), count)]
+        at_top = paragraph == 0 and count <= rows
+        while len(window) < rows and paragraph > 0:
+            paragraph -= 1
+            lines = self.paragraph_lines(paragraph)
+            count = len(lines) // 2
+            needed = min(count, rows - len(window))
+            window[0:0] = [(lines[2 * i], lines[2 * i + 1]) for i in range(count - needed, count)]
+            at_top = paragraph == 0 and needed == count
+        return window, at_top
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Text rendering helpers used by the typewriter effect.
+
+Calling font.render for every line on every frame allocates new surfaces at
+the frame rate. The helpers in this module render each glyph once, build
+lines out of those cached glyphs, and keep finished line surfaces around so
+they are only rendered once.
+"""
+
+from collections import OrderedDict
+from itertools import accumulate
+
+import pygame
+
+from markup import TextStyle
+
+# Size of each texture page in the glyph atlas
+ATLAS_PAGE_SIZE = 512
+
+# Number of runs of text whose glyph positions the glyph atlas remembers
+OFFSET_CACHE_SIZE = 512
+
+# Most characters text can have grown by for the glyph atlas to reuse the
+# positions of the shorter text
+GROWN_CHARS = 4
+
+# Text used to check whether adding up a font's advances gives font.size widths
+ADVANCE_SAMPLE = "The quick brown fox, jumping over 14 lazy dogs; AVAWAY Ta To."
+
+# Default memory budget for cached line surfaces, in bytes
+LINE_CACHE_BYTES = 8 * 1024 * 1024
+
+
+# --- GlyphAtlas Class (Caches rendered glyphs on shared surfaces) ---
+class GlyphAtlas:
+    """
+    Renders each (font, style, character) once into a shared atlas surface and
+    draws text by blitting those glyphs in a single Surface.blits batch.
+
+    Glyphs are packed row by row onto pages of ATLAS_PAGE_SIZE pixels; a new
+    page is started when the current one is full. Glyph lookups are counted
+    as hits and misses, like LineSurfaceCache's.
+
+    SDL_ttf places glyphs with sub-pixel precision and applies kerning, so
+    adding up each glyph's whole-pixel advance can come out several pixels
+    narrower than font.size over a line (350 instead of 358 pixels for 50
+    characters in pygame's default font). Fonts where that happens have
+    their glyphs placed at the width font.size gives for the text before
+    them, so text drawn through the atlas is as wide as font.size says, which
+    is what line breaking measures with; only the anti-aliased edges of the
+    glyphs can differ slightly from font.render. Those positions are kept for
+    the most recent OFFSET_CACHE_SIZE runs of text.
+    """
+    def __init__(self, page_size=ATLAS_PAGE_SIZE):
+        """
+        Initializes the GlyphAtlas object.
+
+        Args:
+            page_size (int): Width and height of each atlas page in pixels.
+        """
+        self.page_size = page_size
+        self.pages = []
+        self.glyphs = {}      # (font, style, char) -> (page, area rect)
+        self.advances = {}    # (font, bold, italic, char) -> horizontal advance in pixels
+        self.exact_advances = {}        # (font, bold, italic) -> True if advances add up to font.size
+        self.offsets = OrderedDict()    # (font, bold, italic, text) -> X of each glyph, and the end
+        self.hits = 0
+        self.misses = 0
+        self._pen_x = 0
+        self._pen_y = 0
+        self._row_height = 0
+
+    def _new_page(self):
+        """Starts a new, empty atlas page."""
+        self.pages.append(pygame.Surface((self.page_size, self.page_size), pygame.SRCALPHA))
+        self._pen_x = 0
+        self._pen_y = 0
+        self._row_height = 0
+
+    @staticmethod
+    def set_font_style(font, bold=False, italic=False, underline=False):
+        """Switches the font's emphasis on or off."""
+        font.bold = bold
+        font.italic = italic
+        font.underline = underline
+
+    def advance(self, font, char, style=None):
+        """Returns how far the pen moves after drawing `char` in `style`."""
+        bold = style is not None and style.bold
+        italic = style is not None and style.italic
+        key = (font, bold, italic, char)
+        advance = self.advances.get(key)
+        if advance is None:
+            self.set_font_style(font, bold, italic)
+            metrics = font.metrics(char)
+            if metrics and metrics[0] is not None:
+                advance = metrics[0][4]
+            else:
+                advance = font.size(char)[0]
+            self.set_font_style(font)
+            self.advances[key] = advance
+        return advance
+
+    def has_exact_advances(self, font, bold, italic):
+        """Returns True if adding up advances gives the same widths as font.size."""
+        key = (font, bold, italic)
+        exact = self.exact_advances.get(key)
+        if exact is None:
+            self.set_font_style(font, bold, italic)
+            width = font.size(ADVANCE_SAMPLE)[0]
+            self.set_font_style(font)
+            style = TextStyle(None, bold, italic, False)
+            exact = self.exact_advances[key] = width == sum(self.advance(font, char, style)
+                                                            for char in ADVANCE_SAMPLE)
+        return exact
+
+    def glyph_offsets(self, font, text, style=None):
+        """
+        Returns the X position of each glyph of `text` drawn in `style`,
+        relative to the start of the text, followed by the width of the text.
+        """
+        bold = style is not None and style.bold
+        italic = style is not None and style.italic
+        if self.has_exact_advances(font, bold, italic):
+            offsets = [0]
+            offsets.extend(accumulate(self.advance(font, char, style) for char in text))
+            return offsets
+
+        key = (font, bold, italic, text)
+        offsets = self.offsets.get(key)
+        if offsets is not None:
+            self.offsets.move_to_end(key)
+            return offsets
+        # A glyph's position doesn't depend on the text after it, so text that
+        # grew by a few characters (as typed text does) only needs the new ones
+        offsets = [0]
+        for cut in range(1, min(len(text), GROWN_CHARS) + 1):
+            shorter = self.offsets.get((font, bold, italic, text[:-cut]))
+            if shorter is not None:
+                offsets = shorter.copy()
+                break
+        self.set_font_style(font, bold, italic)
+        offsets.extend(font.size(text[:end])[0] for end in range(len(offsets), len(text) + 1))
+        self.set_font_style(font)
+        self.offsets[key] = offsets
+        if len(self.offsets) > OFFSET_CACHE_SIZE:
+            self.offsets.popitem(last=False)
+        return offsets
+
+    def glyph(self, font, style, char):
+        """Returns the (page, area rect) of a glyph, rendering it on first use."""
+        key = (font, style, char)
+        entry = self.glyphs.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        self.set_font_style(font, style.bold, style.italic, style.underline)
+        rendered = font.render(char, True, style.color)
+        self.set_font_style(font)
+        width, height = rendered.get_size()
+        if not self.pages:
+            self._new_page()
+        if self._pen_x + width > self.page_size:
+            # Move on to the next row
+            self._pen_x = 0
+            self._pen_y += self._row_height
+            self._row_height = 0
+        if self._pen_y + height > self.page_size:
+            self._new_page()
+
+        page = self.pages[-1]
+        area = pygame.Rect(self._pen_x, self._pen_y, width, height)
+        page.blit(rendered, area)
+        self._pen_x += width
+        self._row_height = max(self._row_height, height)
+
+        entry = self.glyphs[key] = (page, area)
+        return entry
+
+    def runs_width(self, font, runs, limit=None):
+        """
+        Returns the width of (text, style) runs when drawn through the atlas.
+
+        Args:
+            font (pygame.font.Font): The font used for rendering text.
+            runs (list): (text, style) pairs.
+            limit (int, optional): Only measure this many characters.
+        """
+        width = 0
+        for text, style in runs:
+            offsets = self.glyph_offsets(font, text, style)
+            if limit is not None:
+                if limit <= 0:
+                    break
+                count = min(limit, len(text))
+                limit -= count
+                width += offsets[count]
+            else:
+                width += offsets[-1]
+        return width
+
+    def draw_runs(self, surface, font, runs, pos):
+        """
+        Draws a line made of differently styled runs with one blits call.
+
+        Args:
+            surface (pygame.Surface): The surface to draw on.
+            font (pygame.font.Font): The font used for rendering text.
+            runs (list): (text, TextStyle) pairs, drawn left to right.
+            pos (tuple): The (x, y) position of the start of the line.
+
+        Returns:
+            int: The X position just after the last character.
+        """
+        x, y = pos
+        blit_sequence = []
+        for text, style in runs:
+            offsets = self.glyph_offsets(font, text, style)
+            for char, offset in zip(text, offsets):
+                page, area = self.glyph(font, style, char)
+                blit_sequence.append((page, (x + offset, y), area))
+            x += offsets[-1]
+        surface.blits(blit_sequence, doreturn=False)
+        return x
+
+    def draw(self, surface, font, color, text, pos):
+        """Draws plain text in one color and returns the X position after it."""
+        return self.draw_runs(surface, font, [(text, TextStyle(color, False, False, False))], pos)
+
+    def stats(self):
+        """Returns the atlas counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "glyphs": len(self.glyphs),
+            "pages": len(self.pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_shared_atlas = None
+
+
+def get_glyph_atlas():
+    """Returns the glyph atlas shared by every TypewriterText."""
+    global _shared_atlas
+    if _shared_atlas is None:
+        _shared_atlas = GlyphAtlas()
+    return _shared_atlas
+
+
+# --- LineSurfaceCache Class (Keeps rendered lines within a memory budget) ---
+class LineSurfaceCache:
+    """
+    A least-recently-used cache of rendered line surfaces.
+
+    Each surface is charged its pitch times its height against the byte
+    budget; when the budget is exceeded the least recently used lines are
+    evicted. Hit, miss and eviction counters are kept for tuning the budget.
+    """
+    def __init__(self, max_bytes=LINE_CACHE_BYTES):
+        """
+        Initializes the LineSurfaceCache object.
+
+        Args:
+            max_bytes (int): The most memory the cached surfaces may use.
+        """
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def surface_bytes(surface):
+        """Returns the number of bytes of pixel data held by a surface."""
+        return surface.get_pitch() * surface.get_height()
+
+    def get(self, key):
+        """Returns the cached surface for `key`, or None if it isn't cached."""
+        surface = self.surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.surfaces.move_to_end(key)
+        self.hits += 1
+        return surface
+
+    def put(self, key, surface):
+        """Adds a surface, evicting the least recently used ones if needed."""
+        old_surface = self.surfaces.pop(key, None)
+        if old_surface is not None:
+            self.bytes_used -= self.surface_bytes(old_surface)
+        self.surfaces[key] = surface
+        self.bytes_used += self.surface_bytes(surface)
+
+        # Never evict the surface that was just added
+        while self.bytes_used > self.max_bytes and len(self.surfaces) > 1:
+            _key, evicted = self.surfaces.popitem(last=False)
+            self.bytes_used -= self.surface_bytes(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        """Returns the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.surfaces),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_shared_line_cache = None
+
+
+def get_line_cache():
+    """Returns the line surface cache shared by every TypewriterText."""
+    global _shared_line_cache
+    if _shared_line_cache is None:
+        _shared_line_cache = LineSurfaceCache()
+    return _shared_line_cache